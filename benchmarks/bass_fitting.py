@@ -0,0 +1,108 @@
+"""Compare the vectorized Bass diffusion fit to the previous numba implementation.
+
+The numba path is measured both for the first call (including the JIT
+compilation that every worker pays) and for later calls. The vectorized
+path is measured without and with the fitted parameter cache, and batch
+fitting is compared to fitting the targets one by one.
+
+Run with: python -m benchmarks.bass_fitting
+"""
+import math
+import time
+import timeit
+
+import numpy as np
+import pandas as pd
+import scipy.optimize
+from numba import jit
+
+from calc.bass import fit_bass_parameters, generate_bass_diffusion, generate_bass_diffusions
+
+
+# The BEV share forecast as done in calc.cars.estimate_mileage_ratios
+X_START, X_END, Y_START = 2018, 2035, 0.005
+P, Q = 0.03, 0.6
+N_CALLS = 20
+
+
+@jit(nopython=True)
+def _bass_diffuse(t, m, p, q):
+    e1 = math.e ** (-(p + q) * t)
+    res = ((p + q) ** 2) / p
+    res *= e1 / ((1 + q / p * e1) ** 2)
+    res *= m
+    return res
+
+
+@jit(nopython=True)
+def _generate_bass_series(t, y0, m, p, q):
+    y = y0
+    vals = []
+    for t in range(0, t):
+        f = _bass_diffuse(t, m, p, q)
+        y *= 1 + f
+        vals.append(y)
+    return vals
+
+
+@jit(nopython=True)
+def _test_bass(x, t, y_start, y_end):
+    m, p, q = x
+    s = _generate_bass_series(t + 10, y_start, m, p, q)
+    summed = 0
+    for i in range(1, 10):
+        summed += (y_end - s[-i]) ** 2
+        summed += (s[0] - y_start) ** 2
+    return summed
+
+
+def legacy_generate_bass_diffusion(x_start, x_end, y_start, y_end, p, q):
+    x_diff = x_end - x_start
+    res = scipy.optimize.minimize(
+        _test_bass, [1, 0.03, 0.38], args=(x_diff, y_start, y_end),
+        bounds=[(0, None), (p, p), (q, q)]
+    )
+    m, p, q = res.x
+    s = _generate_bass_series(x_diff, y_start, m, p, q)
+    return pd.Series(data=[y_start] + s, index=range(x_start, x_end + 1))
+
+
+def measure(func):
+    secs = min(timeit.repeat(func, number=N_CALLS, repeat=3))
+    return secs / N_CALLS * 1000
+
+
+def run():
+    targets = np.linspace(0.05, 1.0, 20)
+
+    start = time.perf_counter()
+    legacy_generate_bass_diffusion(X_START, X_END, Y_START, 0.3, P, Q)
+    print('%-36s %10.1f ms' % ('numba, first call (JIT)', (time.perf_counter() - start) * 1000))
+
+    ms = measure(lambda: legacy_generate_bass_diffusion(X_START, X_END, Y_START, 0.3, P, Q))
+    print('%-36s %10.3f ms' % ('numba', ms))
+
+    def uncached():
+        fit_bass_parameters.cache_clear()
+        generate_bass_diffusion(X_START, X_END, Y_START, 0.3, P, Q)
+
+    print('%-36s %10.3f ms' % ('vectorized', measure(uncached)))
+    ms = measure(lambda: generate_bass_diffusion(X_START, X_END, Y_START, 0.3, P, Q))
+    print('%-36s %10.3f ms' % ('vectorized, cached parameters', ms))
+
+    ms = measure(lambda: [legacy_generate_bass_diffusion(X_START, X_END, Y_START, y, P, Q) for y in targets])
+    print('%-36s %10.3f ms' % ('numba, %d targets' % len(targets), ms))
+    ms = measure(lambda: generate_bass_diffusions(X_START, X_END, Y_START, targets, P, Q))
+    print('%-36s %10.3f ms' % ('vectorized batch, %d targets' % len(targets), ms))
+
+    # The results should agree up to the tolerance of the optimizer
+    diff = max(
+        (legacy_generate_bass_diffusion(X_START, X_END, Y_START, y, P, Q) -
+         generate_bass_diffusion(X_START, X_END, Y_START, y, P, Q)).abs().max()
+        for y in targets
+    )
+    print('max difference to numba: %.2e' % diff)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,48 @@
+"""Compare cache serializers on real calcfunc outputs.
+
+Run with: python -m benchmarks.cache_serialization
+"""
+import timeit
+
+from common.serializers import PickleSerializer, ArrowSerializer
+from calc.emissions import predict_emissions
+from calc.electricity import calculate_electricity_supply_emission_factor
+from calc.district_heating import calc_district_heating_unit_emissions_forecast
+from calc.cars import predict_cars_emissions
+
+
+SERIALIZERS = [
+    ('pickle', PickleSerializer()),
+    ('arrow', ArrowSerializer()),
+    ('arrow+verify', ArrowSerializer(verify=True)),
+    ('arrow+snappy', ArrowSerializer(compression='snappy')),
+]
+
+FUNCS = [
+    predict_emissions,
+    calculate_electricity_supply_emission_factor,
+    calc_district_heating_unit_emissions_forecast,
+    predict_cars_emissions,
+]
+
+
+def measure(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=3)) / number * 1000
+
+
+def run():
+    print('%-48s %-14s %6s %10s %10s %12s' % ('calcfunc', 'serializer', 'format', 'encode', 'decode', 'size'))
+    for func in FUNCS:
+        val = func()
+        for name, serializer in SERIALIZERS:
+            data = serializer.dumps(val)
+            number = 5 if len(data) > 1000000 else 50
+            encode = measure(lambda: serializer.dumps(val), number)
+            decode = measure(lambda: serializer.loads(data), number)
+            print('%-48s %-14s %6s %7.2f ms %7.2f ms %9.1f kB' % (
+                func.__name__, name, data[0:1].decode(), encode, decode, len(data) / 1024
+            ))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,275 @@
+"""Benchmark the calc pipeline and track the results over time.
+
+Each calcfunc is measured
+  - cold: with empty result and dataset caches, no prepared datasets
+    and no cached Bass model fits, as in a fresh deployment
+  - warm: with the result in the cache
+  - sweep: recomputed for each value of target_year and of the sliders,
+    with the datasets loaded (as when a user moves a slider)
+
+recording the wall time, the peak memory allocated during the call and
+the cache traffic. The results are appended to a JSON lines history and
+compared to a baseline run (by default the previous one).
+
+The datasets are read from the local dataset store only, so materialize
+them first (python -m utils.dataset_store materialize) or point --store
+to a directory of fixture datasets.
+
+Run with: python -m benchmarks.calc_pipeline [--runs N] [--baseline ID|FILE] [--quick]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from common import cache, settings
+from calc.utils import _dataset_cache, get_declared_datasets
+from calc.bass import fit_bass_parameters
+from calc.emissions import predict_emissions, predict_emission_reductions
+from calc.cars import predict_cars_emissions
+from calc.district_heating import calc_district_heating_unit_emissions_forecast
+from calc.geothermal import predict_geothermal_production
+from calc.electricity import calculate_electricity_supply_emission_factor
+from utils import dataset_store
+from variables import override_variables
+
+
+FUNCS = [
+    predict_emissions,
+    predict_emission_reductions,
+    predict_cars_emissions,
+    calc_district_heating_unit_emissions_forecast,
+    predict_geothermal_production,
+    calculate_electricity_supply_emission_factor,
+]
+
+SWEEPS = [
+    ('target_year', [2030, 2035, 2040, 2045]),
+    ('cars_bev_percentage', [0, 25, 50, 75, 100]),
+    ('district_heating_existing_building_efficiency_change', [-3.0, -2.0, -1.0, 0.0]),
+    ('geothermal_new_building_installation_share', [0, 25, 50, 75, 100]),
+    ('solar_power_existing_buildings_percentage', [0, 50, 100]),
+]
+
+HISTORY_FILE = os.path.join(os.path.dirname(__file__), 'results', 'calc_pipeline.jsonl')
+
+# Changes smaller than these are reported as noise
+REGRESSION_PERCENT = 10
+REGRESSION_MIN_MS = 1.0
+
+
+def cache_counts():
+    stats = cache.get_stats()
+    counts = {}
+    for tier, tier_stats in stats.items():
+        for key in ('hits', 'misses', 'sets'):
+            if key in tier_stats:
+                counts['%s_%s' % (tier, key)] = tier_stats[key]
+    return counts
+
+
+def measure_call(func):
+    """Wall time in ms, peak allocated MB and cache traffic of one call"""
+    before = cache_counts()
+    start = time.perf_counter()
+    func()
+    ms = (time.perf_counter() - start) * 1000
+    after = cache_counts()
+    traffic = {key: after[key] - before.get(key, 0) for key in after}
+    return ms, traffic
+
+
+def measure_peak_mb(func, prepare):
+    # tracemalloc slows down the calls, so the peak is measured on a
+    # separate run from the timings.
+    prepare()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def clear_results():
+    cache.clear()
+
+
+def clear_all():
+    cache.clear()
+    _dataset_cache.clear()
+    fit_bass_parameters.cache_clear()
+    version = dataset_store.get_store().version
+    if version is not None:
+        shutil.rmtree(os.path.join(settings.PREPARED_DATASET_DIR, version), ignore_errors=True)
+
+
+def run_case(func, prepare, runs):
+    times = []
+    traffic = None
+    for i in range(runs):
+        prepare()
+        ms, run_traffic = measure_call(func)
+        times.append(ms)
+        if traffic is None:
+            traffic = run_traffic
+    return dict(
+        ms=min(times),
+        median_ms=statistics.median(times),
+        peak_mb=measure_peak_mb(func, prepare),
+        cache=traffic,
+    )
+
+
+def run_sweep(func, var_name, values, runs):
+    times = []
+    peaks = []
+    for val in values:
+        with override_variables(**{var_name: val}):
+            res = run_case(func, clear_results, runs)
+        times.append(res['ms'])
+        peaks.append(res['peak_mb'])
+    return dict(
+        ms=statistics.median(times),
+        max_ms=max(times),
+        peak_mb=max(peaks),
+        values=dict(zip([str(x) for x in values], times)),
+    )
+
+
+def run_benchmarks(runs, sweeps):
+    results = {}
+    for func in FUNCS:
+        name = func.__name__
+        results['cold %s' % name] = run_case(func, clear_all, runs)
+        print('%-70s %9.1f ms' % ('cold %s' % name, results['cold %s' % name]['ms']))
+
+        func()
+        results['warm %s' % name] = run_case(func, lambda: None, runs)
+        print('%-70s %9.1f ms' % ('warm %s' % name, results['warm %s' % name]['ms']))
+
+        for var_name, values in sweeps:
+            case = 'sweep %s %s' % (var_name, name)
+            results[case] = run_sweep(func, var_name, values, runs)
+            print('%-70s %9.1f ms' % (case, results[case]['ms']))
+    return results
+
+
+def git_revision():
+    try:
+        out = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode().strip()
+
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def find_baseline(history, baseline):
+    if baseline is None:
+        return history[-1] if history else None
+    if os.path.exists(baseline):
+        with open(baseline, 'r') as f:
+            return json.load(f)
+    for entry in history:
+        if entry['id'] == baseline or entry.get('revision') == baseline:
+            return entry
+    raise SystemExit('Baseline %s not found in the history' % baseline)
+
+
+def compare(baseline, entry):
+    """Print the change of each case to the baseline, return the regressed cases"""
+    print()
+    print('Compared to %s (revision %s, %s)' % (baseline['id'], baseline.get('revision'), baseline['time']))
+    print('%-70s %12s %12s %8s' % ('case', 'baseline', 'current', 'change'))
+    regressions = []
+    for case, res in entry['results'].items():
+        old = baseline['results'].get(case)
+        if old is None:
+            print('%-70s %12s %9.1f ms' % (case, '-', res['ms']))
+            continue
+        diff = res['ms'] - old['ms']
+        change = diff / old['ms'] * 100 if old['ms'] else 0
+        flag = ''
+        if change > REGRESSION_PERCENT and diff > REGRESSION_MIN_MS:
+            flag = '  REGRESSION'
+            regressions.append(case)
+        print('%-70s %9.1f ms %9.1f ms %+7.1f%%%s' % (case, old['ms'], res['ms'], change, flag))
+    print('%d cases regressed by more than %d%%' % (len(regressions), REGRESSION_PERCENT))
+    return regressions
+
+
+def check_datasets():
+    store = dataset_store.get_store()
+    missing = sorted(x for x in get_declared_datasets() if not store.has_dataset(x))
+    if missing:
+        raise SystemExit(
+            'Datasets missing from the store at %s:\n  %s\n'
+            'Run python -m utils.dataset_store materialize first.' % (store.root_dir, '\n  '.join(missing))
+        )
+    return store.version
+
+
+def run(runs, sweeps, history_file, baseline=None, save=True):
+    dataset_version = check_datasets()
+    history = read_history(history_file)
+
+    now = datetime.now()
+    entry = dict(
+        id=now.strftime('%Y%m%d-%H%M%S'),
+        time=now.isoformat(timespec='seconds'),
+        revision=git_revision(),
+        dataset_version=dataset_version,
+        python=platform.python_version(),
+        runs=runs,
+        results=run_benchmarks(runs, sweeps),
+    )
+    if save:
+        append_history(history_file, entry)
+
+    regressions = []
+    baseline_entry = find_baseline(history, baseline)
+    if baseline_entry is not None:
+        regressions = compare(baseline_entry, entry)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='skip the variable sweeps')
+    parser.add_argument('--store', help='dataset store directory (default: DATASET_STORE_DIR)')
+    parser.add_argument('--history', default=HISTORY_FILE)
+    parser.add_argument('--baseline', help='run id, revision or JSON file (default: the previous run)')
+    parser.add_argument('--no-save', action='store_true', help='do not append the results to the history')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    if args.store:
+        dataset_store._store = dataset_store.DatasetStore(args.store)
+    regressions = run(
+        args.runs, [] if args.quick else SWEEPS, args.history, baseline=args.baseline, save=not args.no_save
+    )
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
@@ -0,0 +1,53 @@
+"""Measure the per-call overhead of a calcfunc on a cache hit.
+
+Run with: python -m benchmarks.calcfunc_overhead
+"""
+import hashlib
+import json
+import timeit
+
+from variables import get_variable
+from calc.utils import _get_func_hash_data, _hash_funcs, get_func_hash_data, _calculate_cache_key
+from calc.emissions import predict_emissions, predict_emission_reductions
+from calc.cars import predict_cars_emissions
+
+
+N_CALLS = 200
+
+
+def legacy_cache_key(func):
+    # The key computation as it was done before the dependency data
+    # was memoized: full recursive walk and code hashing on every call.
+    hash_data = _get_func_hash_data(func, None)
+    var_data = json.dumps({x: get_variable(x) for x in hash_data['variables']}, sort_keys=True)
+    func_hash = _hash_funcs(hash_data['funcs'])
+    func_name = '.'.join((func.__module__, func.__name__))
+    return '%s:%s:%s' % (func_name, hashlib.md5(var_data.encode()).hexdigest(), func_hash)
+
+
+def memoized_cache_key(func):
+    return _calculate_cache_key(func, get_func_hash_data(func))
+
+
+def measure(stmt):
+    secs = min(timeit.repeat(stmt, number=N_CALLS, repeat=5))
+    return secs / N_CALLS * 1000000
+
+
+def run():
+    funcs = [predict_emission_reductions, predict_emissions, predict_cars_emissions]
+
+    # Populate the cache
+    for func in funcs:
+        func()
+
+    print('%-40s %12s %12s %12s' % ('calcfunc', 'legacy key', 'key', 'cache hit'))
+    for func in funcs:
+        legacy = measure(lambda: legacy_cache_key(func))
+        key = measure(lambda: memoized_cache_key(func))
+        hit = measure(func)
+        print('%-40s %9.1f us %9.1f us %9.1f us' % (func.__name__, legacy, key, hit))
+
+
+if __name__ == '__main__':
+    run()
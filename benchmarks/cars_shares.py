@@ -0,0 +1,202 @@
+"""Compare the vectorized car engine share allocation to the previous loops.
+
+Checks that estimate_mileage_ratios and calculate_co2e_per_engine_type
+give the same results as the previous per-year implementations (kept
+here) for target years 2025-2050, and times both. The inputs are
+synthetic; with --full predict_cars_emissions is also computed with
+both implementations from the real datasets and compared.
+
+Run with: python -m benchmarks.cars_shares [--full]
+"""
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import calc.cars
+from calc.bass import generate_bass_diffusion
+from calc.cars import estimate_bev_unit_emissions, estimate_mileage_ratios, calculate_co2e_per_engine_type
+from common import cache
+
+
+LAST_HIST_YEAR = 2018
+TARGET_YEARS = range(2025, 2050 + 1, 5)
+BEV_TARGET_SHARES = [0.0, 0.3, 0.9]
+CLASSES = ['EURO %d' % i for i in range(0, 6 + 1)]
+
+
+def legacy_estimate_mileage_ratios(df, last_hist_year, target_year, bev_target_share):
+    last_bev_share = df.loc['electric'].sum().sum()
+    bev_series = generate_bass_diffusion(
+        last_hist_year, target_year, last_bev_share, bev_target_share,
+        p=0.03, q=0.6
+    )
+
+    diesel = df.loc['diesel'].copy()
+    gas = df.loc['gasoline'].copy()
+    last_diesel_share = diesel.sum().sum()
+    last_gas_share = gas.sum().sum()
+    diesel_per_gas = last_diesel_share / (last_gas_share + last_diesel_share)
+
+    out = []
+
+    for year in range(last_hist_year + 1, target_year + 1):
+        bev_share = bev_series.loc[year]
+        bev_share_change = bev_share - last_bev_share
+
+        share_left = dict(diesel=bev_share_change * diesel_per_gas)
+        share_left['gasoline'] = bev_share_change - share_left['diesel']
+
+        shares_per_engine = dict(diesel=diesel, gasoline=gas)
+
+        for i in range(0, 6 + 1):
+            key = 'EURO %d' % i
+            for eng in ('diesel', 'gasoline'):
+                if not share_left[eng]:
+                    continue
+
+                val = shares_per_engine[eng][key]
+                decrease = min(val, share_left[eng])
+                shares_per_engine[eng][key] -= decrease
+                share_left[eng] -= decrease
+
+        shares_per_engine['electric'] = {'EURO 6': bev_share}
+        for eng in ('diesel', 'gasoline', 'electric'):
+            z = dict(shares_per_engine[eng])
+            z['Year'] = year
+            z['Engine'] = eng
+            out.append(z)
+
+        last_bev_share = bev_share
+
+    df = df.copy()
+    df['Year'] = last_hist_year
+    df = pd.concat([df.reset_index(), pd.DataFrame(out)], sort=False)
+    df = df.fillna(0).set_index(['Engine', 'Year'])
+    df = df.unstack('Engine')
+    df = df.ffill()
+    df = df.stack('Engine')
+
+    return df
+
+
+def legacy_calculate_co2e_per_engine_type(mileage, ratios, unit_emissions):
+    df = ratios.unstack('Engine')
+    df_h = df.multiply(mileage['Highways'], axis='index')
+    df_r = df.multiply(mileage['Urban'], axis='index')
+    df_h['Road'] = 'Highways'
+    df_r['Road'] = 'Urban'
+
+    df = pd.concat([df_h, df_r]).reset_index().set_index(['Year', 'Road']).unstack('Road')
+    df.columns = df.columns.reorder_levels([0, 2, 1])
+
+    df = df * unit_emissions
+    df = df.stack('Road')
+
+    df = (df.sum(axis=1) / 1000000000).unstack('Road')
+    last_hist_year = mileage[~mileage.Forecast].index.max()
+    df = df.loc[df.index > last_hist_year]
+    mileage.loc[mileage.index > last_hist_year, 'HighwaysEmissions'] = df['Highways']
+    mileage.loc[mileage.index > last_hist_year, 'UrbanEmissions'] = df['Urban']
+
+    return mileage
+
+
+def make_inputs(target_year):
+    rng = np.random.RandomState(0)
+    shares = pd.DataFrame(
+        rng.uniform(0, 1, (3, len(CLASSES))), index=['diesel', 'electric', 'gasoline'], columns=CLASSES
+    )
+    shares.loc['electric'] = 0
+    shares.loc['electric', 'EURO 6'] = 0.5
+    shares /= shares.values.sum()
+    shares.index.name = 'Engine'
+
+    years = range(2005, target_year + 1)
+    mileage = pd.DataFrame(dict(
+        Highways=np.linspace(2e9, 2.5e9, len(years)),
+        Urban=np.linspace(1e9, 1.2e9, len(years)),
+    ), index=years)
+    mileage['Forecast'] = mileage.index > LAST_HIST_YEAR
+
+    unit_df = pd.DataFrame(
+        rng.uniform(100, 250, (4, len(CLASSES))), columns=CLASSES,
+        index=pd.MultiIndex.from_product([['Highways', 'Urban'], ['diesel', 'gasoline']], names=['Road', 'Engine']),
+    )
+    unit_df['Year'] = LAST_HIST_YEAR
+    elec = pd.Series(np.linspace(150, 30, target_year - LAST_HIST_YEAR + 1), name='EmissionFactor',
+                     index=range(LAST_HIST_YEAR, target_year + 1))
+    unit_emissions = estimate_bev_unit_emissions(unit_df, elec)
+    return shares, mileage, unit_emissions
+
+
+def compare_frames(a, b):
+    a = a.sort_index().sort_index(axis=1)
+    b = b.reindex(index=a.index, columns=a.columns)
+    return np.nanmax(np.abs(a.values.astype(float) - b.values.astype(float)))
+
+
+def check_and_time():
+    print('%-12s %-6s %12s %12s %12s' % ('target year', 'BEV', 'max diff', 'legacy', 'vectorized'))
+    worst = 0
+    for target_year in TARGET_YEARS:
+        shares, mileage, unit_emissions = make_inputs(target_year)
+        for bev_share in BEV_TARGET_SHARES:
+            args = (shares, LAST_HIST_YEAR, target_year, bev_share)
+            old = legacy_estimate_mileage_ratios(*args)
+            new = estimate_mileage_ratios(*args)
+            diff = compare_frames(old, new)
+
+            old_em = legacy_calculate_co2e_per_engine_type(mileage.copy(), old, unit_emissions)
+            new_em = calculate_co2e_per_engine_type(mileage.copy(), new, unit_emissions)
+            diff = max(diff, compare_frames(old_em, new_em))
+            worst = max(worst, diff)
+
+            def run_legacy():
+                ratios = legacy_estimate_mileage_ratios(*args)
+                legacy_calculate_co2e_per_engine_type(mileage.copy(), ratios, unit_emissions)
+
+            def run_vectorized():
+                ratios = estimate_mileage_ratios(*args)
+                calculate_co2e_per_engine_type(mileage.copy(), ratios, unit_emissions)
+
+            legacy_ms = min(timeit.repeat(run_legacy, number=5, repeat=3)) / 5 * 1000
+            vectorized_ms = min(timeit.repeat(run_vectorized, number=5, repeat=3)) / 5 * 1000
+            print('%-12d %-6.1f %12.2e %9.2f ms %9.2f ms' % (target_year, bev_share, diff, legacy_ms, vectorized_ms))
+    return worst
+
+
+def check_predict_cars_emissions():
+    from calc.cars import predict_cars_emissions
+    from variables import override_variables
+
+    worst = 0
+    for target_year in TARGET_YEARS:
+        with override_variables(target_year=target_year):
+            cache.clear()
+            new = predict_cars_emissions()
+            calc.cars.estimate_mileage_ratios = legacy_estimate_mileage_ratios
+            calc.cars.calculate_co2e_per_engine_type = legacy_calculate_co2e_per_engine_type
+            try:
+                cache.clear()
+                old = predict_cars_emissions()
+            finally:
+                calc.cars.estimate_mileage_ratios = estimate_mileage_ratios
+                calc.cars.calculate_co2e_per_engine_type = calculate_co2e_per_engine_type
+        diff = compare_frames(old.select_dtypes('number'), new.select_dtypes('number'))
+        print('predict_cars_emissions, target year %d: max diff %.2e' % (target_year, diff))
+        worst = max(worst, diff)
+    return worst
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--full', action='store_true', help='also compare predict_cars_emissions on the real datasets')
+    args = parser.parse_args()
+
+    worst = check_and_time()
+    if args.full:
+        worst = max(worst, check_predict_cars_emissions())
+    assert worst < 1e-9, 'The vectorized results differ from the previous implementation'
+    print('OK, max difference %.2e' % worst)
@@ -0,0 +1,191 @@
+"""Measure the latency of the Dash callbacks as the browser calls them.
+
+Posts _dash-update-component requests to the Flask test client: the page
+render callback for every page and the page callbacks with their sliders
+at the minimum, initial and maximum values. Each request is measured
+with a cold result cache (cleared before every request) and a warm one,
+and the p50 and p95 latency and the response size are reported per
+callback.
+
+The payloads are generated from the registered callbacks and the
+rendered pages. They can be saved with --save-payloads, edited or
+replaced by ones recorded from the browser and replayed with --payloads.
+
+Run with: python -m benchmarks.dash_callbacks [--repeat N] [--pages /path ...]
+"""
+import argparse
+import json
+import time
+
+from dash.development.base_component import Component
+
+from common import cache
+from ghgdash import app
+from pages.routing import all_pages, page_instance
+
+
+UPDATE_URL = '/_dash-update-component'
+RENDER_INPUTS = [dict(id='url', property='pathname'), dict(id='url', property='href')]
+RENDER_OUTPUTS = [dict(id='app-content', property='children')]
+
+
+def iter_components(el):
+    if isinstance(el, (list, tuple)):
+        for child in el:
+            yield from iter_components(child)
+        return
+    if not isinstance(el, Component):
+        return
+    yield el
+    yield from iter_components(getattr(el, 'children', None))
+
+
+def get_page_components():
+    """Map the id of every component on the rendered pages to (page, component)"""
+    components = {}
+    for page in all_pages.values():
+        page = page_instance(page)
+        for el in iter_components(page.render()):
+            el_id = getattr(el, 'id', None)
+            if el_id:
+                components[el_id] = (page, el)
+    return components
+
+
+def _output_key(outputs):
+    # The multi-output callback key as in Dash 1.x
+    return '..%s..' % '...'.join('%s.%s' % (x['id'], x['property']) for x in outputs)
+
+
+def make_payload(output, inputs, values, state=None, changed=None):
+    return dict(
+        output=output,
+        inputs=[dict(x, value=val) for x, val in zip(inputs, values)],
+        state=state or [],
+        changedPropIds=changed or ['%s.%s' % (x['id'], x['property']) for x in inputs],
+    )
+
+
+def get_page_callbacks(paths=None):
+    """The page callbacks of the given page paths with the initial values of their inputs
+
+    Returns a list of dicts with the page path, the callback output key,
+    inputs and state and, for each input, the slider bounds if the input
+    is a slider.
+    """
+    components = get_page_components()
+    render_output = _output_key(RENDER_OUTPUTS)
+    callbacks = []
+    for output, callback in app.callback_map.items():
+        inputs = callback['inputs']
+        if output == render_output or not inputs:
+            continue
+        found = [components.get(x['id']) for x in inputs]
+        if not all(found):
+            continue
+        page = found[0][0]
+        if paths and page.path not in paths:
+            continue
+        callbacks.append(dict(
+            path=page.path,
+            output=output,
+            inputs=inputs,
+            state=[dict(x, value=page.path) for x in callback.get('state', [])],
+            initial=[getattr(el, x['property'], None) for (_, el), x in zip(found, inputs)],
+            sliders=[
+                dict(min=getattr(el, 'min', None), max=getattr(el, 'max', None), step=getattr(el, 'step', 1))
+                for _, el in found
+            ],
+        ))
+    return callbacks
+
+
+def make_render_payload(path):
+    return make_payload(_output_key(RENDER_OUTPUTS), RENDER_INPUTS, [path, 'http://localhost%s' % path])
+
+
+def generate_payloads(paths=None):
+    """Return a list of (name, payload) for the callbacks of the given page paths"""
+    payloads = []
+    for path in all_pages:
+        if paths and path not in paths:
+            continue
+        payloads.append(('render %s' % path, make_render_payload(path)))
+
+    for cb in get_page_callbacks(paths):
+        output, inputs, state, initial = cb['output'], cb['inputs'], cb['state'], cb['initial']
+        payloads.append(('%s initial' % cb['path'], make_payload(output, inputs, initial, state)))
+        # Move each slider to its extremes with the others at their initial values
+        for i, slider in enumerate(cb['sliders']):
+            for bound in ('min', 'max'):
+                val = slider[bound]
+                if val is None or val == initial[i]:
+                    continue
+                values = list(initial)
+                values[i] = val
+                name = '%s %s=%s' % (cb['path'], inputs[i]['id'], val)
+                payloads.append((name, make_payload(output, inputs, values, state, [inputs[i]['id'] + '.value'])))
+    return payloads
+
+
+def percentile(values, perc):
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(perc / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def post(client, payload):
+    start = time.perf_counter()
+    resp = client.post(UPDATE_URL, data=json.dumps(payload), content_type='application/json')
+    ms = (time.perf_counter() - start) * 1000
+    if resp.status_code not in (200, 204):
+        raise Exception('%s returned %d' % (payload['output'], resp.status_code))
+    return ms, len(resp.data)
+
+
+def measure(client, payload, repeat, warm):
+    times = []
+    size = None
+    if warm:
+        post(client, payload)
+    for i in range(repeat):
+        if not warm:
+            cache.clear()
+        ms, size = post(client, payload)
+        times.append(ms)
+    return times, size
+
+
+def run(payloads, repeat):
+    client = app.server.test_client()
+    # Load the datasets before measuring
+    for name, payload in payloads:
+        post(client, payload)
+
+    print('%-64s %-5s %10s %10s %10s' % ('callback', 'cache', 'p50', 'p95', 'size'))
+    for name, payload in payloads:
+        for warm in (False, True):
+            times, size = measure(client, payload, repeat, warm)
+            print('%-64s %-5s %7.1f ms %7.1f ms %7.1f kB' % (
+                name, 'warm' if warm else 'cold', percentile(times, 50), percentile(times, 95), size / 1024
+            ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--pages', nargs='*', help='page paths to measure (default: all)')
+    parser.add_argument('--payloads', help='replay the payloads from this JSON file')
+    parser.add_argument('--save-payloads', help='write the generated payloads to this JSON file')
+    args = parser.parse_args()
+
+    if args.payloads:
+        with open(args.payloads, 'r') as f:
+            payloads = [tuple(x) for x in json.load(f)]
+    else:
+        payloads = generate_payloads(args.pages)
+    if args.save_payloads:
+        with open(args.save_payloads, 'w') as f:
+            json.dump(payloads, f, indent=2)
+
+    run(payloads, args.repeat)
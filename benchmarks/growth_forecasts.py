@@ -0,0 +1,136 @@
+"""Compare the vectorized compound growth forecasts to the previous loops.
+
+Checks that the heat use per net area forecasts (calc.buildings), the
+electricity consumption per capita forecast (calc.electricity) and the
+geothermal area forecast (calc.geothermal) give the same values as the
+previous per-year loops (kept here) for a range of yearly changes and
+target years, and times both. The inputs are synthetic. numpy.power may
+differ from ** in the last bit, so the values are compared with a
+relative tolerance of 1e-12.
+
+Run with: python -m benchmarks.growth_forecasts
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from calc.growth import compound_factors, compound_series, percent_factor
+
+
+LAST_HIST_YEAR = 2018
+TARGET_YEARS = [2025, 2035, 2050]
+CHANGES = [-3.0, -0.5, 0.0, 1.2, 4.0]
+
+
+def legacy_existing_buildings(df, change_perc):
+    df = df.copy()
+    first_forecast_year = df[df.Forecast].index.min()
+    for year in df[df.Forecast].index:
+        factor = (1 + (change_perc / 100)) ** (year - first_forecast_year + 1)
+        df.loc[year, 'HeatUsePerNetArea'] *= factor
+    return df
+
+
+def existing_buildings(df, change_perc):
+    df = df.copy()
+    forecast_years = df[df.Forecast].index
+    factors = compound_factors(percent_factor(change_perc), forecast_years - forecast_years.min() + 1)
+    df.loc[df.Forecast, 'HeatUsePerNetArea'] *= factors
+    return df
+
+
+def legacy_new_buildings(change_perc, target_year):
+    years = range(LAST_HIST_YEAR, target_year + 1)
+    vals = []
+    for year in years:
+        factor = (1 + (change_perc / 100)) ** (year - LAST_HIST_YEAR + 1)
+        vals.append(95 * factor)
+    return pd.Series(vals, index=years)
+
+
+def new_buildings(change_perc, target_year):
+    years = range(LAST_HIST_YEAR, target_year + 1)
+    factors = compound_factors(percent_factor(change_perc), np.arange(1, len(years) + 1))
+    return pd.Series(95 * factors, index=years)
+
+
+def legacy_electricity(el_per_capita, per_capita_adj, target_year):
+    el_per_capita = el_per_capita.copy()
+    last_year = el_per_capita.index.max()
+    last_per = el_per_capita[last_year]
+    for year in range(last_year + 1, target_year + 1):
+        last_per *= 1 + (per_capita_adj / 100)
+        el_per_capita.loc[year] = last_per
+    return el_per_capita
+
+
+def electricity(el_per_capita, per_capita_adj, target_year):
+    last_year = el_per_capita.index.max()
+    forecast = compound_series(
+        el_per_capita[last_year], percent_factor(per_capita_adj), range(last_year + 1, target_year + 1)
+    )
+    return pd.concat([el_per_capita, forecast])
+
+
+def legacy_geothermal(dh_area, yearly_renovation, target_year):
+    dh_left = dh_area.copy()
+    geo = pd.Series(dtype=float)
+    for year in range(LAST_HIST_YEAR + 1, target_year + 1):
+        dh_left *= (1 - yearly_renovation)
+        geo.loc[year] = float(dh_area - dh_left)
+    return geo
+
+
+def geothermal(dh_area, yearly_renovation, target_year):
+    dh_left = compound_series(dh_area, 1 - yearly_renovation, range(LAST_HIST_YEAR + 1, target_year + 1))
+    return (dh_area - dh_left).astype(float)
+
+
+def make_inputs(target_year):
+    rng = np.random.RandomState(0)
+    years = range(2000, target_year + 1)
+    df = pd.DataFrame(dict(HeatUsePerNetArea=rng.uniform(120, 160, len(years))), index=years)
+    df['Forecast'] = df.index > LAST_HIST_YEAR
+    el_per_capita = pd.Series(rng.uniform(6000, 8000, LAST_HIST_YEAR - 2000 + 1), index=range(2000, LAST_HIST_YEAR + 1))
+    dh_area = np.float64(rng.uniform(3e7, 4e7))
+    return df, el_per_capita, dh_area
+
+
+def same(a, b):
+    if not a.index.equals(b.index):
+        return False
+    return np.allclose(np.asarray(a, dtype=float), np.asarray(b, dtype=float), rtol=1e-12, atol=0)
+
+
+def run():
+    print('%-12s %-30s %12s %12s' % ('target year', 'forecast', 'legacy', 'vectorized'))
+    ok = True
+    for target_year in TARGET_YEARS:
+        df, el_per_capita, dh_area = make_inputs(target_year)
+        cases = [
+            ('existing buildings', legacy_existing_buildings, existing_buildings, lambda c: (df, c)),
+            ('new buildings', legacy_new_buildings, new_buildings, lambda c: (c, target_year)),
+            ('electricity per capita', legacy_electricity, electricity, lambda c: (el_per_capita, c, target_year)),
+            ('geothermal', legacy_geothermal, geothermal, lambda c: (dh_area, abs(c) / 100, target_year)),
+        ]
+        for name, legacy_func, func, make_args in cases:
+            for change in CHANGES:
+                old = legacy_func(*make_args(change))
+                new = func(*make_args(change))
+                if isinstance(old, pd.DataFrame):
+                    old, new = old['HeatUsePerNetArea'], new['HeatUsePerNetArea']
+                if not same(old, new):
+                    print('%-12d %-30s differs with change %s' % (target_year, name, change))
+                    ok = False
+
+            args = make_args(CHANGES[0])
+            legacy_ms = min(timeit.repeat(lambda: legacy_func(*args), number=10, repeat=3)) / 10 * 1000
+            vectorized_ms = min(timeit.repeat(lambda: func(*args), number=10, repeat=3)) / 10 * 1000
+            print('%-12d %-30s %9.3f ms %9.3f ms' % (target_year, name, legacy_ms, vectorized_ms))
+    return ok
+
+
+if __name__ == '__main__':
+    assert run(), 'The vectorized results differ from the previous implementation'
+    print('OK, all results within tolerance')
@@ -0,0 +1,73 @@
+"""Report where the time goes when a worker imports the app.
+
+Imports the app in a fresh interpreter with python -X importtime and
+lists the slowest modules of this project and the third-party packages
+taking the most time in total. Exits with an error if the import of the
+app takes longer than the budget.
+
+Run with: python -m benchmarks.import_time [--module ghgdash] [--budget-ms 3000]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from common import settings
+
+
+PROJECT_PACKAGES = ('calc', 'common', 'components', 'pages', 'utils', 'variables', 'layout', 'ghgdash')
+
+
+def measure_imports(module):
+    """Return a list of (module name, self ms, cumulative ms) in import order"""
+    env = dict(os.environ, PYTHONPATH=settings.BASE_DIR)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    if proc.returncode != 0:
+        raise Exception('Importing %s failed:\n%s' % (module, proc.stderr.decode()[-2000:]))
+
+    imports = []
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        imports.append((parts[2].strip(), int(parts[0]) / 1000, int(parts[1]) / 1000))
+    return imports
+
+
+def run(module, budget_ms, top):
+    imports = measure_imports(module)
+    total = next(cum for name, _, cum in imports if name == module)
+
+    own = [x for x in imports if x[0].split('.')[0] in PROJECT_PACKAGES]
+    print('%-50s %12s %12s' % ('module', 'self', 'cumulative'))
+    for name, self_ms, cum_ms in sorted(own, key=lambda x: -x[1])[:top]:
+        print('%-50s %9.1f ms %9.1f ms' % (name, self_ms, cum_ms))
+
+    packages = {}
+    for name, self_ms, _ in imports:
+        pkg = name.split('.')[0]
+        if pkg not in PROJECT_PACKAGES:
+            packages[pkg] = packages.get(pkg, 0) + self_ms
+    print()
+    print('%-50s %12s' % ('third-party package', 'total'))
+    for pkg, ms in sorted(packages.items(), key=lambda x: -x[1])[:top]:
+        print('%-50s %9.1f ms' % (pkg, ms))
+
+    print()
+    print('import %s: %.1f ms (budget %d ms)' % (module, total, budget_ms))
+    return total <= budget_ms
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='ghgdash')
+    parser.add_argument('--budget-ms', type=int, default=3000)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+    if not run(args.module, args.budget_ms, args.top):
+        sys.exit('Import time over budget')
@@ -0,0 +1,257 @@
+"""Simulate many concurrent users, each with their own session, moving sliders.
+
+Every simulated user opens a page and then keeps adjusting its sliders a
+few steps at a time (with think time in between), now and then moving to
+another page. The custom slider values are stored in the session of the
+user, so the users fragment the cache as they do in production.
+
+By default a local Redis server and gunicorn are started for the run
+(redis-server and gunicorn must be in PATH); use --url and --redis-url
+to test running instances instead. Reports the throughput, the latency
+percentiles, the calcfunc cache hit ratio (from the X-Calc-Stats header)
+and the Redis hit ratio and memory growth.
+
+Run with: python -m benchmarks.load_test [--users N] [--actions N] [--workers N]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import requests
+from redis import Redis
+
+from common import settings
+from benchmarks.dash_callbacks import UPDATE_URL, get_page_callbacks, make_payload, make_render_payload, percentile
+
+
+# Probability of moving to another page instead of adjusting a slider
+PAGE_CHANGE_PROBABILITY = 0.15
+# Slider steps moved at a time
+SLIDER_MOVES = [-3, -2, -1, 1, 2, 3]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(check, timeout, what):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise Exception('Timed out waiting for %s' % what)
+
+
+@contextmanager
+def start_redis():
+    if not shutil.which('redis-server'):
+        raise SystemExit('redis-server not found; pass --redis-url to use a running Redis')
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        proc = subprocess.Popen(
+            ['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no', '--dir', tmp_dir],
+            stdout=subprocess.DEVNULL,
+        )
+        url = 'redis://127.0.0.1:%d/0' % port
+        try:
+            wait_for(lambda: Redis.from_url(url).ping(), 10, 'redis')
+            yield url
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+@contextmanager
+def start_gunicorn(redis_url, workers, threads, env_overrides):
+    port = free_port()
+    env = dict(os.environ, REDIS_URL=redis_url, CALC_STATS_HEADER='1', **env_overrides)
+    proc = subprocess.Popen(
+        ['gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers), '--threads', str(threads),
+         '--bind', '127.0.0.1:%d' % port, '--timeout', '300', 'ghgdash:server'],
+        cwd=settings.BASE_DIR, env=env,
+    )
+    url = 'http://127.0.0.1:%d' % port
+    try:
+        wait_for(lambda: requests.get(url + '/', timeout=5).ok, 600, 'gunicorn')
+        yield url
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def parse_calc_stats(header):
+    stats = {}
+    for part in (header or '').split(';'):
+        key, _, val = part.strip().partition('=')
+        if key:
+            stats[key] = int(val)
+    return stats
+
+
+class SimulatedUser:
+    def __init__(self, base_url, callbacks, rng, think_time, results):
+        self.base_url = base_url
+        self.callbacks = callbacks
+        self.rng = rng
+        self.think_time = think_time
+        self.results = results
+        self.session = requests.Session()
+        self.callback = None
+        self.values = None
+
+    def post(self, kind, payload):
+        start = time.perf_counter()
+        try:
+            resp = self.session.post(self.base_url + UPDATE_URL, data=json.dumps(payload), headers={
+                'Content-Type': 'application/json',
+            }, timeout=300)
+            ok = resp.status_code in (200, 204)
+            size = len(resp.content)
+            stats = parse_calc_stats(resp.headers.get('X-Calc-Stats'))
+        except requests.RequestException:
+            ok, size, stats = False, 0, {}
+        ms = (time.perf_counter() - start) * 1000
+        self.results.append(dict(kind=kind, ms=ms, ok=ok, size=size, stats=stats))
+
+    def open_page(self):
+        self.callback = self.rng.choice(self.callbacks)
+        self.values = list(self.callback['initial'])
+        self.post('render', make_render_payload(self.callback['path']))
+        # The page callback fires when the page is shown
+        self.post('callback', self.make_callback_payload(None))
+
+    def make_callback_payload(self, changed_idx):
+        cb = self.callback
+        changed = None
+        if changed_idx is not None:
+            changed = ['%s.%s' % (cb['inputs'][changed_idx]['id'], cb['inputs'][changed_idx]['property'])]
+        return make_payload(cb['output'], cb['inputs'], self.values, cb['state'], changed)
+
+    def move_slider(self):
+        sliders = [i for i, x in enumerate(self.callback['sliders']) if x['min'] is not None]
+        if not sliders:
+            return self.open_page()
+        idx = self.rng.choice(sliders)
+        slider = self.callback['sliders'][idx]
+        step = slider['step'] or 1
+        val = self.values[idx] + self.rng.choice(SLIDER_MOVES) * step
+        self.values[idx] = min(max(val, slider['min']), slider['max'])
+        self.post('slider', self.make_callback_payload(idx))
+
+    def run(self, n_actions):
+        self.open_page()
+        for i in range(n_actions):
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1 / self.think_time))
+            if self.rng.random() < PAGE_CHANGE_PROBABILITY:
+                self.open_page()
+            else:
+                self.move_slider()
+
+
+def redis_info(redis_url):
+    info = Redis.from_url(redis_url).info()
+    return dict(
+        hits=info['keyspace_hits'], misses=info['keyspace_misses'], used_memory=info['used_memory'],
+        keys=sum(x.get('keys', 0) for name, x in info.items() if name.startswith('db') and isinstance(x, dict)),
+    )
+
+
+def report(results, duration, redis_before, redis_after):
+    print('%d requests in %.1f s, %.1f requests/s, %d errors' % (
+        len(results), duration, len(results) / duration, len([x for x in results if not x['ok']])
+    ))
+    print('%-10s %8s %10s %10s %10s %10s %10s' % ('request', 'count', 'p50', 'p95', 'p99', 'max', 'size'))
+    kinds = ['render', 'callback', 'slider']
+    for kind in kinds + ['all']:
+        res = [x for x in results if kind == 'all' or x['kind'] == kind]
+        if not res:
+            continue
+        times = [x['ms'] for x in res]
+        print('%-10s %8d %7.1f ms %7.1f ms %7.1f ms %7.1f ms %7.1f kB' % (
+            kind, len(res), percentile(times, 50), percentile(times, 95), percentile(times, 99), max(times),
+            sum(x['size'] for x in res) / len(res) / 1024,
+        ))
+
+    stats = {}
+    for res in results:
+        for key, val in res['stats'].items():
+            stats[key] = stats.get(key, 0) + val
+    lookups = stats.get('memo_hits', 0) + stats.get('cache_hits', 0) + stats.get('cache_misses', 0)
+    if lookups:
+        print('calcfunc lookups: %d, memo hits %.1f %%, cache hits %.1f %%, misses %.1f %%' % (
+            lookups, stats.get('memo_hits', 0) / lookups * 100, stats.get('cache_hits', 0) / lookups * 100,
+            stats.get('cache_misses', 0) / lookups * 100,
+        ))
+
+    hits = redis_after['hits'] - redis_before['hits']
+    misses = redis_after['misses'] - redis_before['misses']
+    if hits + misses:
+        print('redis: hit ratio %.1f %% (%d lookups)' % (hits / (hits + misses) * 100, hits + misses))
+    print('redis: memory %.1f MB -> %.1f MB, %d -> %d keys' % (
+        redis_before['used_memory'] / 1024 / 1024, redis_after['used_memory'] / 1024 / 1024,
+        redis_before['keys'], redis_after['keys'],
+    ))
+
+
+def run(base_url, redis_url, n_users, n_actions, think_time, ramp_up, seed, pages):
+    callbacks = [x for x in get_page_callbacks(pages) if any(s['min'] is not None for s in x['sliders'])]
+    if not callbacks:
+        raise SystemExit('No pages with sliders found')
+
+    results = []
+    threads = []
+    redis_before = redis_info(redis_url)
+    start = time.perf_counter()
+    for i in range(n_users):
+        user = SimulatedUser(base_url, callbacks, random.Random(seed + i), think_time, results)
+        thread = threading.Thread(target=user.run, args=(n_actions,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        if ramp_up:
+            time.sleep(ramp_up / n_users)
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    report(results, duration, redis_before, redis_info(redis_url))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--actions', type=int, default=20, help='slider moves or page changes per user')
+    parser.add_argument('--think-time', type=float, default=1.0, help='mean seconds between actions')
+    parser.add_argument('--ramp-up', type=float, default=10.0, help='seconds over which the users start')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pages', nargs='*', help='page paths to use (default: all with sliders)')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--warmup', action='store_true', help='start gunicorn with WARMUP=1')
+    parser.add_argument('--url', help='test a running server instead of starting gunicorn')
+    parser.add_argument('--redis-url', help='use a running Redis instead of starting one')
+    args = parser.parse_args()
+
+    if args.url and not args.redis_url:
+        sys.exit('--url requires --redis-url')
+
+    redis_cm = nullcontext(args.redis_url) if args.redis_url else start_redis()
+    with redis_cm as redis_url:
+        env = dict(WARMUP='1') if args.warmup else {}
+        server_cm = nullcontext(args.url) if args.url else start_gunicorn(redis_url, args.workers, args.threads, env)
+        with server_cm as base_url:
+            run(base_url, redis_url, args.users, args.actions, args.think_time, args.ramp_up, args.seed, args.pages)
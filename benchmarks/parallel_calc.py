@@ -0,0 +1,45 @@
+"""Compare the cold-cache latency of predict_emission_reductions computed
+serially and with the dependencies evaluated in parallel.
+
+The datasets are loaded before measuring, so only the calculations are
+timed. The result cache is cleared before every run.
+
+Run with: python -m benchmarks.parallel_calc [--workers N] [--runs N]
+"""
+import argparse
+import time
+
+from common import cache
+from calc.utils import set_parallel_workers
+from calc.emissions import predict_emission_reductions
+
+
+def measure(runs):
+    times = []
+    for i in range(runs):
+        cache.clear()
+        start = time.perf_counter()
+        predict_emission_reductions()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times), sorted(times)[len(times) // 2]
+
+
+def run(workers, runs):
+    # Load the datasets
+    set_parallel_workers(0)
+    predict_emission_reductions()
+
+    print('%-16s %12s %12s' % ('mode', 'min', 'median'))
+    for name, n in (('serial', 0), ('parallel (%d)' % workers, workers)):
+        set_parallel_workers(n)
+        best, median = measure(runs)
+        print('%-16s %9.1f ms %9.1f ms' % (name, best, median))
+    set_parallel_workers(0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    run(args.workers, args.runs)
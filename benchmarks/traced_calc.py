@@ -0,0 +1,81 @@
+"""Check that the calls that are not traced work with tracing enabled.
+
+Prefetched dependencies and the scenarios of evaluate_scenarios run on
+the untraced node even when CALC_TRACE is set, so a calcfunc loading a
+cold dataset there must not record anything on it. Uses a small dataset
+in a temporary store and reports the traced latencies.
+
+Run with: python -m benchmarks.traced_calc
+"""
+import tempfile
+import time
+
+import pandas as pd
+
+from common import cache, settings
+from calc import calcfunc
+from calc import utils as calc_utils
+from calc.scenarios import evaluate_scenarios
+from utils import dataset_store
+from utils.dataset_store import DatasetStore
+
+
+DATASET = 'benchmark/traced_calc'
+
+
+@calcfunc(datasets=dict(df=DATASET))
+def sum_dataset(datasets):
+    return datasets['df'].value.sum()
+
+
+@calcfunc(funcs=[sum_dataset])
+def add_to_sum():
+    return sum_dataset() + 1
+
+
+@calcfunc(variables=['target_year'], datasets=dict(df=DATASET))
+def scale_dataset(variables, datasets):
+    df = datasets['df'].copy()
+    df['value'] *= variables['target_year']
+    return df
+
+
+def run_request():
+    memo = calc_utils.RequestMemo()
+    token = calc_utils._bound_memo.set(memo)
+    try:
+        start = time.perf_counter()
+        ret = add_to_sum()
+        return ret, memo.trace, (time.perf_counter() - start) * 1000
+    finally:
+        calc_utils._bound_memo.reset(token)
+        memo.close()
+
+
+def main():
+    store = DatasetStore(tempfile.mkdtemp())
+    store.materialize({DATASET: pd.DataFrame(dict(value=[1.0, 2.0, 3.0]))}, format='arrow')
+    dataset_store._store = store
+
+    settings.CALC_TRACE = True
+    calc_utils.set_parallel_workers(2)
+
+    cache.clear()
+    calc_utils._dataset_cache.clear()
+    ret, trace, ms = run_request()
+    assert ret == 7.0
+    assert [node.name for node in trace] == [add_to_sum.__module__ + '.add_to_sum']
+    print('%-24s %9.1f ms' % ('prefetched, cold', ms))
+    print(calc_utils.format_trace(trace))
+
+    cache.clear()
+    calc_utils._dataset_cache.clear()
+    start = time.perf_counter()
+    df = evaluate_scenarios([dict(target_year=2030), dict(target_year=2035)], func=scale_dataset, to_long=None)
+    ms = (time.perf_counter() - start) * 1000
+    assert df.value.groupby(level='Scenario').sum().tolist() == [6.0 * 2030, 6.0 * 2035]
+    print('%-24s %9.1f ms' % ('scenarios, cold', ms))
+
+
+if __name__ == '__main__':
+    main()
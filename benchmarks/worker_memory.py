@@ -0,0 +1,104 @@
+"""Measure the memory use of worker processes loading the calcfunc datasets.
+
+Starts a number of worker processes, loads the datasets declared by the
+calcfuncs in each of them as the app does (with the columns, filters
+and partitions of each DatasetSpec) and reports RSS and PSS
+(proportional set size, where shared pages are divided between the
+processes mapping them) per worker, once from parquet files and once
+from memory-mapped Arrow files.
+
+Run with: python -m benchmarks.worker_memory [--workers N]
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+
+from calc.utils import get_declared_datasets, get_dataset_selections
+from utils.dataset_store import DatasetStore, load_dataset
+
+
+def read_memory_kb():
+    out = {}
+    paths = ['/proc/self/smaps_rollup', '/proc/self/status']
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            for line in f:
+                key, _, val = line.partition(':')
+                if key in ('Rss', 'VmRSS', 'Pss'):
+                    out.setdefault(key.replace('VmRSS', 'Rss'), int(val.split()[0]))
+    return out
+
+
+def worker(store_dir, memory_map, barrier, results):
+    from common import settings
+    from calc import utils as calc_utils
+    from utils import dataset_store
+
+    settings.DATASET_STORE_MMAP = memory_map
+    before = read_memory_kb()
+    dataset_store._store = DatasetStore(store_dir)
+    datasets = []
+    for spec in sorted(calc_utils.get_declared_dataset_specs(), key=repr):
+        dataset = calc_utils._load_dataset_spec(calc_utils._resolve_dataset_spec(spec, partitioned=True))
+        if isinstance(dataset, calc_utils.DatasetPartitions):
+            datasets += list(dataset.partitions.values())
+        else:
+            datasets.append(dataset)
+    # Touch all the data as the calculations would
+    for df in datasets:
+        df.memory_usage(deep=True)
+    # Wait until all workers have loaded the data before measuring
+    barrier.wait()
+    after = read_memory_kb()
+    results.put(dict(before=before, after=after))
+    barrier.wait()
+
+
+def measure(store_dir, memory_map, n_workers):
+    barrier = multiprocessing.Barrier(n_workers)
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=worker, args=(store_dir, memory_map, barrier, results))
+        for i in range(n_workers)
+    ]
+    for p in procs:
+        p.start()
+    mem = [results.get(timeout=600) for p in procs]
+    for p in procs:
+        p.join()
+    return mem
+
+
+def run(n_workers):
+    datasets = {path: load_dataset(path) for path in sorted(get_declared_datasets())}
+
+    with tempfile.TemporaryDirectory() as parquet_dir, tempfile.TemporaryDirectory() as arrow_dir:
+        DatasetStore(parquet_dir).materialize(datasets, format='parquet')
+        DatasetStore(arrow_dir).materialize(datasets, format='arrow', selections=get_dataset_selections())
+        del datasets
+
+        modes = [
+            ('parquet', parquet_dir, False),
+            ('arrow', arrow_dir, False),
+            ('arrow (mmap)', arrow_dir, True),
+        ]
+        print('%-14s %14s %14s %18s' % ('format', 'RSS/worker', 'PSS/worker', 'RSS growth/worker'))
+        for name, store_dir, memory_map in modes:
+            mem = measure(store_dir, memory_map, n_workers)
+            rss = sum(x['after']['Rss'] for x in mem) / len(mem) / 1024
+            pss = sum(x['after'].get('Pss', 0) for x in mem) / len(mem) / 1024
+            growth = sum(x['after']['Rss'] - x['before']['Rss'] for x in mem) / len(mem) / 1024
+            print('%-14s %11.1f MB %11.1f MB %15.1f MB' % (name, rss, pss, growth))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    # Start the workers from scratch so that nothing loaded by this
+    # process is inherited by them
+    multiprocessing.set_start_method('spawn')
+    run(args.workers)
@@ -1,4 +1,4 @@
-from .utils import calcfunc
+from .utils import calcfunc, prepared_dataset, Variable
 
 
-__all__ = [calcfunc]
+__all__ = [calcfunc, prepared_dataset, Variable]
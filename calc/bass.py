@@ -1,42 +1,100 @@
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
-import math
 import scipy.optimize
-from numba import jit
 
 
-@jit(nopython=True)
-def _bass_diffuse(t, m, p, q):
-    e1 = math.e ** (-(p + q) * t)
-    res = ((p + q) ** 2) / p
-    res *= e1 / ((1 + q / p * e1) ** 2)
-    res *= m
-    return res
+# The fitted curve should reach the target value during the last
+# N_TAIL steps of a series that is extended past the end year.
+N_TAIL = 9
+EXTRA_STEPS = 10
+
+
+def bass_pdf(t, p, q):
+    """Closed-form Bass adoption rate at times t (for market size m = 1)"""
+    e1 = np.exp(-(p + q) * t)
+    return ((p + q) ** 2 / p) * e1 / (1 + q / p * e1) ** 2
 
 
-@jit(nopython=True)
-def _generate_bass_series(t, y0, m, p, q):
-    y = y0
-    vals = []
-    for t in range(0, t):
-        f = _bass_diffuse(t, m, p, q)
-        y *= 1 + f
-        vals.append(y)
-    return vals
+def generate_bass_series(n, y0, m, p, q):
+    """Grow y0 by the Bass adoption rate for n steps
 
+    `m` can be an array of shape (k, 1) to generate k series at once.
+    """
+    f = np.multiply(m, bass_pdf(np.arange(n), p, q))
+    return y0 * np.cumprod(1 + f, axis=-1)
 
-@jit(nopython=True)
-def _test_bass(x, t, y_start, y_end):
+
+def _bass_loss(x, t, y_start, y_end):
     m, p, q = x
-    s = _generate_bass_series(t + 10, y_start, m, p, q)
-    summed = 0
-    for i in range(1, 10):
-        summed += (y_end - s[-i]) ** 2
-        summed += (s[0] - y_start) ** 2
-    return summed
+    s = generate_bass_series(t + EXTRA_STEPS, y_start, m, p, q)
+    return ((y_end - s[-N_TAIL:]) ** 2).sum() + N_TAIL * (s[0] - y_start) ** 2
 
 
-def generate_bass_diffusion(x_start, x_end, y_start, y_end, p=None, q=None):
-    x_diff = x_end - x_start
+def _bass_loss_gradient(m, g, y_start, y_end):
+    # Derivative of _bass_loss with respect to m, for arrays of m and
+    # y_end of shape (k, 1) and the adoption rates g of the whole series
+    s = y_start * np.cumprod(1 + m * g, axis=-1)
+    ds = s * np.cumsum(g / (1 + m * g), axis=-1)
+    tail = 2 * ((s[:, -N_TAIL:] - y_end) * ds[:, -N_TAIL:]).sum(axis=-1)
+    head = N_TAIL * 2 * (s[:, 0] - y_start) * ds[:, 0]
+    return tail + head
+
+
+def fit_bass_m(t, y_start, y_ends, p, q, tolerance=1e-12, max_iterations=200):
+    """Fit the market size m for fixed p and q to many target values at once"""
+    y_ends = np.asarray(y_ends, dtype=float).reshape(-1, 1)
+    g = bass_pdf(np.arange(t + EXTRA_STEPS), p, q)
+
+    def grad(m):
+        return _bass_loss_gradient(m.reshape(-1, 1), g, y_start, y_ends)
+
+    # Bracket the minimum by doubling m while the loss is still decreasing
+    lo = np.zeros(len(y_ends))
+    hi = np.ones(len(y_ends))
+    f_lo = grad(lo)
+    f_hi = grad(hi)
+    for i in range(max_iterations):
+        rising = f_hi < 0
+        if not rising.any():
+            break
+        lo = np.where(rising, hi, lo)
+        f_lo = np.where(rising, f_hi, f_lo)
+        hi = np.where(rising, hi * 2, hi)
+        f_hi = grad(hi)
+
+    # If the loss increases already at m = 0, the bound is the minimum
+    done = f_lo >= 0
+    hi = np.where(done, 0, hi)
+    f_hi = np.where(done, 1, f_hi)
+
+    # Find the zero of the gradient with the Illinois variant of regula falsi
+    side = np.zeros(len(y_ends))
+    for i in range(max_iterations):
+        if ((hi - lo) <= tolerance * np.maximum(hi, 1)).all():
+            break
+        m = np.where(done, lo, (lo * f_hi - hi * f_lo) / (f_hi - f_lo))
+        f_m = grad(m)
+        left = f_m < 0
+        lo, f_lo = np.where(left, m, lo), np.where(left, f_m, f_lo)
+        hi, f_hi = np.where(left, hi, m), np.where(left, f_hi, f_m)
+        f_hi = np.where(left & (side < 0), f_hi / 2, f_hi)
+        f_lo = np.where(~left & (side > 0), f_lo / 2, f_lo)
+        side = np.where(left, -1, 1)
+        done = done | (f_m == 0)
+        lo = np.where(f_m == 0, m, lo)
+        hi = np.where(f_m == 0, m, hi)
+
+    return np.where(done, lo, (lo + hi) / 2)
+
+
+@lru_cache(maxsize=1024)
+def fit_bass_parameters(t, y_start, y_end, p=None, q=None):
+    """Fit (m, p, q) so that the series grows from y_start to y_end in t steps"""
+    if p is not None and q is not None:
+        m = fit_bass_m(t, y_start, [y_end], p, q)[0]
+        return float(m), p, q
 
     x0 = [1, 0.03, 0.38]
     if p is not None:
@@ -48,12 +106,27 @@ def generate_bass_diffusion(x_start, x_end, y_start, y_end, p=None, q=None):
     else:
         q_bounds = (0.001, 1)
     res = scipy.optimize.minimize(
-        _test_bass, x0, args=(x_diff, y_start, y_end),
+        _bass_loss, x0, args=(t, y_start, y_end),
         bounds=[(0, None), p_bounds, q_bounds]
     )
     m, p, q = res.x
-    s = _generate_bass_series(x_diff, y_start, m, p, q)
-    return pd.Series(data=[y_start] + s, index=range(x_start, x_end + 1))
+    return float(m), float(p), float(q)
+
+
+def generate_bass_diffusion(x_start, x_end, y_start, y_end, p=None, q=None):
+    x_diff = x_end - x_start
+    m, p, q = fit_bass_parameters(x_diff, y_start, y_end, p, q)
+    s = generate_bass_series(x_diff, y_start, m, p, q)
+    return pd.Series(data=[y_start] + list(s), index=range(x_start, x_end + 1))
+
+
+def generate_bass_diffusions(x_start, x_end, y_start, y_ends, p, q):
+    """Fit and generate the series for many target values at once (one column per target)"""
+    x_diff = x_end - x_start
+    m = fit_bass_m(x_diff, y_start, y_ends, p, q)
+    s = generate_bass_series(x_diff, y_start, m.reshape(-1, 1), p, q)
+    data = np.hstack([np.full((len(m), 1), y_start), s]).T
+    return pd.DataFrame(data, index=range(x_start, x_end + 1), columns=list(y_ends))
 
 
 if __name__ == '__main__':
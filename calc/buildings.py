@@ -1,10 +1,26 @@
+import numpy as np
 import pandas as pd
 import scipy.stats
 
-from . import calcfunc
+from . import calcfunc, prepared_dataset, Variable
+from .growth import compound_factors, percent_factor
 from .population import get_adjusted_population_forecast
 
 
+# The building stock (a01s_hki_rakennuskanta) and district heat use
+# (e12_helsingin_kaukolammon_sahkonkulutus) datasets are only known to
+# have Helsinki's figures, with Helsinki as '091 Helsinki' in the Alue
+# column of the former.
+BUILDING_DATASET_MUNICIPALITIES = ('Helsinki',)
+
+
+def check_building_dataset_municipality(municipality_name):
+    if municipality_name not in BUILDING_DATASET_MUNICIPALITIES:
+        raise ValueError('The building and district heating calculations support only %s, not %s' % (
+            ', '.join(BUILDING_DATASET_MUNICIPALITIES), municipality_name
+        ))
+
+
 def generate_forecast_series(historical_series, year_until):
     s = historical_series
     start_year = s.index.min()
@@ -15,14 +31,19 @@ def generate_forecast_series(historical_series, year_until):
     return predictions
 
 
-@calcfunc(
+@prepared_dataset(
     datasets=dict(
-        buildings='jyrjola/aluesarjat/a01s_hki_rakennuskanta',
-    )
+        buildings=dict(
+            path='jyrjola/aluesarjat/a01s_hki_rakennuskanta',
+            filters=[('Alue', '==', '091 Helsinki')],
+        ),
+    ),
+    variables=['municipality_name'],
 )
-def prepare_historical_building_area_dataset(datasets):
-    df = datasets['buildings']
-    df = df.loc[df.Alue == '091 Helsinki'].drop(columns='Alue')
+def prepare_historical_building_area_dataset(variables, datasets):
+    check_building_dataset_municipality(variables['municipality_name'])
+
+    df = datasets['buildings'].drop(columns='Alue')
     df = df.loc[df.Valmistumisvuosi != 'Yhteensä'].copy()
     df = df.rename(columns={'Käyttötarkoitus ja kerrosluku': 'Käyttötarkoitus'})
     df = df[~df['Käyttötarkoitus'].str.contains('yhteensä')]
@@ -79,20 +100,27 @@ def generate_building_floor_area_forecast(variables):
 
 @calcfunc(
     datasets=dict(
-        energy_use='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
-        building_stock='jyrjola/aluesarjat/a01s_hki_rakennuskanta'
+        energy_use=dict(
+            path='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
+            filters=[('Kunta', '==', Variable('municipality_name')), ('Energiamuoto', '==', 'Kaukolämpö')],
+        ),
+        building_stock=dict(
+            path='jyrjola/aluesarjat/a01s_hki_rakennuskanta',
+            filters=[
+                ('Alue', '==', '091 Helsinki'), ('Yksikkö', '==', 'Kerrosala'),
+                ('Käyttötarkoitus ja kerrosluku', '==', 'Kaikki rakennukset'),
+            ],
+        ),
     ),
     variables=['municipality_name', 'target_year', 'district_heating_existing_building_efficiency_change']
 )
 def generate_heat_use_per_net_area_forecast_existing_buildings(variables, datasets):
-    assert variables['municipality_name'] == 'Helsinki'
+    check_building_dataset_municipality(variables['municipality_name'])
 
-    bdf = datasets['building_stock'].query('Alue == "091 Helsinki" & Yksikkö == "Kerrosala"')
-    bdf = bdf.loc[bdf['Käyttötarkoitus ja kerrosluku'] == "Kaikki rakennukset"]
+    bdf = datasets['building_stock']
     net_area = bdf.query('Valmistumisvuosi == "Yhteensä"').set_index('Vuosi').value
 
-    muni_energy_use = datasets['energy_use'].query('Kunta == "Helsinki" & Energiamuoto == "Kaukolämpö"')\
-        .drop(columns=['Energiamuoto', 'Kunta'])
+    muni_energy_use = datasets['energy_use'].drop(columns=['Energiamuoto', 'Kunta'])
     edf = muni_energy_use
     edf = edf.loc[edf.Sektori.isin(['Ominaiskulutus sääkorjaamaton (kWh/m3)', 'Ominaiskulutus sääkorjattu (kWh/m3)'])]
     edf = edf.pivot(index='Vuosi', columns='Sektori', values='value').dropna()
@@ -112,10 +140,9 @@ def generate_heat_use_per_net_area_forecast_existing_buildings(variables, datase
 
     change_perc = variables['district_heating_existing_building_efficiency_change']
     df['HeatUsePerNetArea'] = df['HeatUsePerNetArea'].fillna(heat_use_per_net_area.iloc[-1])
-    first_forecast_year = df[df.Forecast].index.min()
-    for year in df[df.Forecast].index:
-        factor = (1 + (change_perc / 100)) ** (year - first_forecast_year + 1)
-        df.loc[year, 'HeatUsePerNetArea'] *= factor
+    forecast_years = df[df.Forecast].index
+    factors = compound_factors(percent_factor(change_perc), forecast_years - forecast_years.min() + 1)
+    df.loc[df.Forecast, 'HeatUsePerNetArea'] *= factors
 
     return df
 
@@ -129,15 +156,10 @@ def generate_heat_use_per_net_area_forecast_new_buildings(variables):
     heat_use_per_net_area = 95
     start_year = 2018
     years = range(start_year, target_year + 1)
-
-    vals = []
     change_perc = variables['district_heating_new_building_efficiency_change']
 
-    for year in years:
-        factor = (1 + (change_perc / 100)) ** (year - start_year + 1)
-        vals.append(heat_use_per_net_area * factor)
-
-    return pd.Series(vals, index=years)
+    factors = compound_factors(percent_factor(change_perc), np.arange(1, len(years) + 1))
+    return pd.Series(heat_use_per_net_area * factors, index=years)
 
 
 if __name__ == '__main__':
@@ -1,21 +1,25 @@
+import numpy as np
 import pandas as pd
-from . import calcfunc
+from . import calcfunc, prepared_dataset, Variable
 from .bass import generate_bass_diffusion
 from .population import get_adjusted_population_forecast
 from .electricity import predict_electricity_emission_factor
 
 
-@calcfunc(
+@prepared_dataset(
     datasets=dict(
-        emissions='jyrjola/lipasto/emissions_by_municipality',
+        emissions=dict(
+            path='jyrjola/lipasto/emissions_by_municipality',
+            columns=['Year', 'Vehicle', 'Road', 'Mileage', 'CO2e'],
+            filters=[('Municipality', '==', Variable('municipality_name'))],
+        ),
     ),
     variables=[
         'municipality_name'
     ]
 )
 def prepare_car_emissions_dataset(datasets, variables):
-    df = datasets['emissions']
-    df = df[df.Municipality == 'Helsinki'].copy()
+    df = datasets['emissions'].copy()
     df.Vehicle = df.Vehicle.astype('category')
     df.Road = df.Road.astype('category')
     return df
@@ -57,62 +61,49 @@ def predict_cars_mileage(variables):
     return df
 
 
+EURO_CLASSES = ['EURO %d' % i for i in range(0, 6 + 1)]
+ROADS = ['Highways', 'Urban']
+
+
 def estimate_mileage_ratios(df, last_hist_year, target_year, bev_target_share):
     # Assume BEV share is increasing according to the Bass diffusion model
     # and that increase in share comes equally out of petrol and diesel engines
     # starting from the most polluting engine classes.
+    df = df.fillna(0)
+    years = np.arange(last_hist_year, target_year + 1)
+    engines = sorted(df.index)
+    df = df.loc[engines]
 
-    last_bev_share = df.loc['electric'].sum().sum()
+    last_bev_share = df.loc['electric'].sum()
     bev_series = generate_bass_diffusion(
         last_hist_year, target_year, last_bev_share, bev_target_share,
         p=0.03, q=0.6
     )
+    bev_share = bev_series.loc[years].values
+    # The Bass series never decreases, so the share taken from the other
+    # engines up to each year is the cumulative increase in the BEV share.
+    bev_share_change = bev_share - last_bev_share
 
-    diesel = df.loc['diesel'].copy()
-    gas = df.loc['gasoline'].copy()
-    last_diesel_share = diesel.sum().sum()
-    last_gas_share = gas.sum().sum()
+    last_diesel_share = df.loc['diesel'].sum()
+    last_gas_share = df.loc['gasoline'].sum()
     diesel_per_gas = last_diesel_share / (last_gas_share + last_diesel_share)
 
-    out = []
-
-    for year in range(last_hist_year + 1, target_year + 1):
-        bev_share = bev_series.loc[year]
-        bev_share_change = bev_share - last_bev_share
-
-        share_left = dict(diesel=bev_share_change * diesel_per_gas)
-        share_left['gasoline'] = bev_share_change - share_left['diesel']
-
-        shares_per_engine = dict(diesel=diesel, gasoline=gas)
+    # (year x engine x class) cube of the mileage shares
+    shares = np.repeat(df.values[np.newaxis, :, :], len(years), axis=0)
+    class_idx = [df.columns.get_loc(x) for x in EURO_CLASSES if x in df.columns]
+    for eng, ratio in (('diesel', diesel_per_gas), ('gasoline', 1 - diesel_per_gas)):
+        # Take the decrease out of the lowest classes first
+        eng_idx = engines.index(eng)
+        s = df.values[eng_idx, class_idx]
+        decrease = bev_share_change[:, np.newaxis] * ratio
+        shares[:, eng_idx, class_idx] = np.clip(np.cumsum(s) - decrease, 0, s)
 
-        for i in range(0, 6 + 1):
-            key = 'EURO %d' % i
-            for eng in ('diesel', 'gasoline'):
-                if not share_left[eng]:
-                    continue
+    eng_idx = engines.index('electric')
+    shares[1:, eng_idx, :] = 0
+    shares[1:, eng_idx, df.columns.get_loc('EURO 6')] = bev_share[1:]
 
-                val = shares_per_engine[eng][key]
-                decrease = min(val, share_left[eng])
-                shares_per_engine[eng][key] -= decrease
-                share_left[eng] -= decrease
-
-        shares_per_engine['electric'] = {'EURO 6': bev_share}
-        for eng in ('diesel', 'gasoline', 'electric'):
-            z = dict(shares_per_engine[eng])
-            z['Year'] = year
-            z['Engine'] = eng
-            out.append(z)
-
-        last_bev_share = bev_share
-
-    df['Year'] = last_hist_year
-    df = df.reset_index().append(out)
-    df = df.fillna(0).set_index(['Engine', 'Year'])
-    df = df.unstack('Engine')
-    df = df.fillna(method='ffill')
-    df = df.stack('Engine')
-
-    return df
+    index = pd.MultiIndex.from_product([years, engines], names=['Year', 'Engine'])
+    return pd.DataFrame(shares.reshape(-1, len(df.columns)), index=index, columns=df.columns)
 
 
 def estimate_bev_unit_emissions(unit_emissions, kwh_emissions):
@@ -130,27 +121,29 @@ def estimate_bev_unit_emissions(unit_emissions, kwh_emissions):
     df['Engine'] = 'electric'
     df = df.set_index(['Road', 'Engine'])
 
-    df = unit_emissions.append(df, sort=True)
+    df = pd.concat([unit_emissions, df], sort=True)
     df = df.reset_index().set_index(['Year', 'Road', 'Engine'])
-    df = df.unstack(['Road', 'Engine']).fillna(method='pad')
+    df = df.unstack(['Road', 'Engine']).ffill()
 
     return df
 
 
 def calculate_co2e_per_engine_type(mileage, ratios, unit_emissions):
-    df = ratios.unstack('Engine')
-    df_h = df.multiply(mileage['Highways'], axis='index')
-    df_r = df.multiply(mileage['Urban'], axis='index')
-    df_h['Road'] = 'Highways'
-    df_r['Road'] = 'Urban'
+    years = ratios.index.levels[0]
+    engines = ratios.index.levels[1]
+    classes = ratios.columns
 
-    df = df_h.append(df_r).reset_index().set_index(['Year', 'Road']).unstack('Road')
-    df.columns = df.columns.reorder_levels([0, 2, 1])
+    # (year x road x engine x class) cube of the emissions
+    shares = ratios.reindex(pd.MultiIndex.from_product([years, engines])).values
+    shares = shares.reshape(len(years), 1, len(engines), len(classes))
+    km = mileage[ROADS].reindex(years).values.reshape(len(years), len(ROADS), 1, 1)
+    unit = unit_emissions.reindex(index=years, columns=pd.MultiIndex.from_product([classes, ROADS, engines]))
+    unit = unit.values.reshape(len(years), len(classes), len(ROADS), len(engines)).transpose(0, 2, 3, 1)
 
-    df = df * unit_emissions
-    df = df.stack('Road')
+    # The engine and class combinations without unit emissions do not count
+    emissions = np.nansum(shares * km * unit, axis=(2, 3)) / 1000000000
+    df = pd.DataFrame(emissions, index=years, columns=ROADS)
 
-    df = (df.sum(axis=1) / 1000000000).unstack('Road')
     last_hist_year = mileage[~mileage.Forecast].index.max()
     df = df.loc[df.index > last_hist_year]
     mileage.loc[mileage.index > last_hist_year, 'HighwaysEmissions'] = df['Highways']
@@ -159,11 +152,27 @@ def calculate_co2e_per_engine_type(mileage, ratios, unit_emissions):
     return mileage
 
 
-@calcfunc(
+@prepared_dataset(
     datasets=dict(
         mileage_per_engine_type='jyrjola/lipasto/mileage_per_engine_type',
+    ),
+)
+def prepare_car_mileage_share_dataset(datasets):
+    df = datasets['mileage_per_engine_type']
+    return df.set_index(['Vehicle', 'Engine']).drop(columns='Sum').xs('Cars')
+
+
+@prepared_dataset(
+    datasets=dict(
         car_unit_emissions='jyrjola/lipasto/car_unit_emissions',
     ),
+)
+def prepare_car_unit_emissions_dataset(datasets):
+    df = datasets['car_unit_emissions']
+    return df.groupby(['Road', 'Engine', 'Class'])['CO2e'].mean().unstack('Class')
+
+
+@calcfunc(
     variables=[
         'target_year', 'municipality_name',
         'cars_bev_percentage'
@@ -171,16 +180,15 @@ def calculate_co2e_per_engine_type(mileage, ratios, unit_emissions):
     funcs=[
         predict_electricity_emission_factor,
         predict_cars_mileage,
-        prepare_car_emissions_dataset
+        prepare_car_emissions_dataset,
+        prepare_car_mileage_share_dataset,
+        prepare_car_unit_emissions_dataset,
     ]
 )
-def predict_cars_emissions(datasets, variables):
+def predict_cars_emissions(variables):
     target_year = variables['target_year']
     bev_percentage = variables['cars_bev_percentage']
 
-    mileage_per_engine_type = datasets['mileage_per_engine_type']
-    mileage_share_per_engine_type = mileage_per_engine_type.set_index(['Vehicle', 'Engine']).drop(columns='Sum')
-
     df = prepare_car_emissions_dataset()
     df = df.loc[df.Vehicle == 'Cars', ['Year', 'CO2e', 'Road']].set_index('Year')
     emissions_df = df.pivot(values='CO2e', columns='Road')
@@ -189,9 +197,8 @@ def predict_cars_emissions(datasets, variables):
     for road in ('Highways', 'Urban'):
         df[road + 'Emissions'] = emissions_df[road] / 1000  # -> kt
 
-    car_unit_emissions = datasets['car_unit_emissions'].set_index(['Engine', 'Road'])
     elec_df = predict_electricity_emission_factor()
-    share_df = mileage_share_per_engine_type.copy().xs('Cars')
+    share_df = prepare_car_mileage_share_dataset()
 
     last_hist_year = df[~df.Forecast].index.max()
 
@@ -199,8 +206,7 @@ def predict_cars_emissions(datasets, variables):
     share = estimate_mileage_ratios(share_df, last_hist_year, target_year, bev_percentage / 100.0)
 
     # Estimate emissions per km per engine type
-    unit_df = car_unit_emissions.reset_index()
-    unit_df = unit_df.groupby(['Road', 'Engine', 'Class']).mean()['CO2e'].unstack('Class')
+    unit_df = prepare_car_unit_emissions_dataset()
     unit_df['Year'] = last_hist_year
     elec_df = elec_df.loc[elec_df.index >= last_hist_year]
     unit_df = estimate_bev_unit_emissions(unit_df, elec_df['EmissionFactor'])
@@ -1,7 +1,8 @@
 import pandas as pd
 
-from . import calcfunc
+from . import calcfunc, Variable
 from .buildings import (
+    check_building_dataset_municipality,
     generate_building_floor_area_forecast,
     generate_heat_use_per_net_area_forecast_existing_buildings,
     generate_heat_use_per_net_area_forecast_new_buildings
@@ -10,9 +11,12 @@ from .buildings import (
 
 @calcfunc(
     datasets=dict(
-        energy_use='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
+        energy_use=dict(
+            path='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
+            filters=[('Kunta', '==', Variable('municipality_name')), ('Energiamuoto', '==', 'Kaukolämpö')],
+        ),
     ),
-    variables=['target_year'],
+    variables=['target_year', 'municipality_name'],
     funcs=[
         generate_building_floor_area_forecast,
         generate_heat_use_per_net_area_forecast_existing_buildings,
@@ -20,13 +24,14 @@ from .buildings import (
     ]
 )
 def predict_district_heat_consumption(variables, datasets):
+    check_building_dataset_municipality(variables['municipality_name'])
+
     net_area = generate_building_floor_area_forecast()
     existing_heating_factor = generate_heat_use_per_net_area_forecast_existing_buildings()
     future_heating_factor = generate_heat_use_per_net_area_forecast_new_buildings()
 
-    heat_use = datasets['energy_use'].query('Kunta == "Helsinki" & Energiamuoto == "Kaukolämpö"')\
-        .drop(columns=['Energiamuoto', 'Kunta']).query('Sektori == "Kulutus yhteensä (GWh)"')\
-        .set_index('Vuosi').value
+    heat_use = datasets['energy_use'].drop(columns=['Energiamuoto', 'Kunta'])\
+        .query('Sektori == "Kulutus yhteensä (GWh)"').set_index('Vuosi').value
     heat_use.index = heat_use.index.astype(int)
     heat_use *= 1000000  # convert to kWh
 
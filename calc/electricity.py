@@ -3,24 +3,34 @@ import pandas as pd
 
 from utils.data import find_consecutive_start
 
-from . import calcfunc
+from . import calcfunc, prepared_dataset, Variable
+from .growth import compound_series, percent_factor
 from .population import get_adjusted_population_forecast
 from .solar_power import predict_solar_power_production
 
 
-@calcfunc(
-    variables=['municipality_name', 'target_year'],
+@prepared_dataset(
+    variables=['municipality_name'],
     datasets=dict(
-        ghg_emissions='jyrjola/hsy/pks_khk_paastot',
+        ghg_emissions=dict(
+            path='jyrjola/hsy/pks_khk_paastot',
+            columns=['Vuosi', 'Päästöt', 'Energiankulutus'],
+            filters=[('Kaupunki', '==', Variable('municipality_name')), ('Sektori1', '==', 'Sähkö')],
+        ),
     )
 )
-def predict_electricity_emission_factor(variables, datasets):
-    df = datasets['ghg_emissions']
-    df = df[df.Kaupunki == variables['municipality_name']].drop(columns='Kaupunki')
-    df = df[df.Sektori1 == 'Sähkö']
+def prepare_electricity_emission_factor_dataset(variables, datasets):
+    df = datasets['ghg_emissions'].copy()
     df['EmissionFactor'] = df['Päästöt'] / df['Energiankulutus'] * 1000
-    s = df.groupby('Vuosi')['EmissionFactor'].mean()
-    df = pd.DataFrame(s)
+    return df.groupby('Vuosi')['EmissionFactor'].mean()
+
+
+@calcfunc(
+    variables=['target_year'],
+    funcs=[prepare_electricity_emission_factor_dataset],
+)
+def predict_electricity_emission_factor(variables):
+    df = pd.DataFrame(prepare_electricity_emission_factor_dataset())
 
     """
     PAST_VALUES = [
@@ -48,18 +58,22 @@ def predict_electricity_emission_factor(variables, datasets):
     return df
 
 
-@calcfunc(
+@prepared_dataset(
     variables=['municipality_name'],
     datasets=dict(
-        energy_consumption='jyrjola/ymparistotilastot/e03_energian_kokonaiskulutus'
+        energy_consumption=dict(
+            path='jyrjola/ymparistotilastot/e03_energian_kokonaiskulutus',
+            columns=['Vuosi', 'value'],
+            filters=[
+                ('Alue', '==', Variable('municipality_name')),
+                ('Sektori', '==', 'Kulutussähkö'),
+                ('Muuttuja', '==', 'Kokonaiskulutus (GWh)'),
+            ],
+        ),
     )
 )
 def prepare_electricity_consumption_dataset(variables, datasets):
     df = datasets['energy_consumption']
-    muni_name = variables['municipality_name']
-    df = df[df.Alue == muni_name]
-    df = df[df.Sektori == 'Kulutussähkö']
-    df = df[df.Muuttuja == 'Kokonaiskulutus (GWh)']
     df = df.rename(columns=dict(Vuosi='Year'))
     df['Year'] = df.Year.astype(int)
     s = df.set_index('Year')['value']
@@ -101,10 +115,10 @@ def predict_electricity_consumption(variables):
 
     s = np.exp(s)
     """
-    last_per = el_per_capita[last_year]
-    for year in range(last_year + 1, target_year + 1):
-        last_per *= 1 + (per_capita_adj / 100)
-        el_per_capita.loc[year] = last_per
+    forecast = compound_series(
+        el_per_capita[last_year], percent_factor(per_capita_adj), range(last_year + 1, target_year + 1)
+    )
+    el_per_capita = pd.concat([el_per_capita, forecast])
 
     el_per_capita.name = 'ElectricityConsumptionPerCapita'
 
@@ -4,7 +4,7 @@ from .district_heating import predict_district_heating_emissions
 from .electricity import predict_electricity_consumption_emissions
 from .geothermal import predict_geothermal_production
 from .cars import predict_cars_emissions
-from . import calcfunc
+from . import calcfunc, prepared_dataset, Variable
 from utils.colors import GHG_MAIN_SECTOR_COLORS
 from utils.data import get_contributions_from_multipliers
 
@@ -103,22 +103,31 @@ for key, val in SECTORS.items():
     val['color'] = GHG_MAIN_SECTOR_COLORS[key]
 
 
+# The 2030 and 2035 emission targets (kt CO2e) by municipality
 TARGETS = {
-    ('BuildingHeating', 'DistrictHeat'): (754.589056908339, 250.733198734865),
-    ('BuildingHeating', 'OilHeating'): (16.1569293157852, 0.0),
-    ('BuildingHeating', 'ElectricityHeating'): (51.0638673954148, 29.7160855925585),
-    ('BuildingHeating', 'GeothermalHeating'): (0, 0),
-    ('ElectricityConsumption', ''): (242.663770299608, 150.979312657901),
-    # ('Liikenne', 262.55592574098, 229.655246625791),
-    ('Transportation', 'Cars'): (128, 118.98),
-    ('Transportation', 'Trucks'): (60, 49.47),
-    ('Transportation', 'OtherTransportation'): (74.55, 61.2),
-    ('Industry', ''): (3.23358058861613, 2.62034901128448),
-    ('Waste', ''): (60.5886441012345, 50.6492489473935),
-    ('Agriculture', ''): (0.637983301315191, 0.55519935555745),
+    'Helsinki': {
+        ('BuildingHeating', 'DistrictHeat'): (754.589056908339, 250.733198734865),
+        ('BuildingHeating', 'OilHeating'): (16.1569293157852, 0.0),
+        ('BuildingHeating', 'ElectricityHeating'): (51.0638673954148, 29.7160855925585),
+        ('BuildingHeating', 'GeothermalHeating'): (0, 0),
+        ('ElectricityConsumption', ''): (242.663770299608, 150.979312657901),
+        # ('Liikenne', 262.55592574098, 229.655246625791),
+        ('Transportation', 'Cars'): (128, 118.98),
+        ('Transportation', 'Trucks'): (60, 49.47),
+        ('Transportation', 'OtherTransportation'): (74.55, 61.2),
+        ('Industry', ''): (3.23358058861613, 2.62034901128448),
+        ('Waste', ''): (60.5886441012345, 50.6492489473935),
+        ('Agriculture', ''): (0.637983301315191, 0.55519935555745),
+    },
 }
 
 
+def get_emission_targets(municipality_name):
+    if municipality_name not in TARGETS:
+        raise ValueError('No emission targets for %s' % municipality_name)
+    return TARGETS[municipality_name]
+
+
 def get_sector_by_path(path):
     if isinstance(path, str):
         path = tuple([path])
@@ -130,14 +139,18 @@ def get_sector_by_path(path):
     return metadata
 
 
-@calcfunc(
+@prepared_dataset(
+    variables=['municipality_name'],
     datasets=dict(
-        ghg_emissions='jyrjola/hsy/pks_khk_paastot',
+        ghg_emissions=dict(
+            path='jyrjola/hsy/pks_khk_paastot',
+            columns=['Vuosi', 'Sektori1', 'Sektori2', 'Sektori3', 'Päästöt'],
+            filters=[('Kaupunki', '==', Variable('municipality_name'))],
+        ),
     ),
 )
-def prepare_emissions_dataset(datasets) -> pd.DataFrame:
+def prepare_emissions_dataset(variables, datasets) -> pd.DataFrame:
     df = datasets['ghg_emissions']
-    df = df[df.Kaupunki == 'Helsinki'].drop(columns='Kaupunki')
     df = df.set_index('Vuosi').copy()
     df = df.reset_index().groupby(['Vuosi', 'Sektori1', 'Sektori2', 'Sektori3'])['Päästöt'].sum().reset_index()
 
@@ -171,7 +184,7 @@ def prepare_emissions_dataset(datasets) -> pd.DataFrame:
 
 
 @calcfunc(
-    variables=['target_year'],
+    variables=['target_year', 'municipality_name'],
     datasets=dict(),
     funcs=[
         prepare_emissions_dataset, predict_district_heating_emissions,
@@ -201,8 +214,9 @@ def predict_emissions(variables, datasets):
         target_map[key] = val
     """
 
-    df.loc[2030] = [TARGETS[key][0] for key in df.columns]
-    df.loc[2035] = [TARGETS[key][1] for key in df.columns]
+    targets = get_emission_targets(variables['municipality_name'])
+    df.loc[2030] = [targets[key][0] for key in df.columns]
+    df.loc[2035] = [targets[key][1] for key in df.columns]
     df = df.interpolate()
 
     pdf = predict_district_heating_emissions()
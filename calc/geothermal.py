@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
 
-from . import calcfunc
+from . import calcfunc, prepared_dataset, Variable
 from .buildings import (
     generate_building_floor_area_forecast,
     generate_heat_use_per_net_area_forecast_existing_buildings,
@@ -9,6 +9,7 @@ from .buildings import (
 )
 from .district_heating import calc_district_heating_unit_emissions_forecast
 from .electricity import predict_electricity_emission_factor
+from .growth import compound_series
 from utils.data import find_consecutive_start
 
 
@@ -31,15 +32,19 @@ get_borehole_production = np.poly1d(np.polyfit(
 ))
 
 
-@calcfunc(
+@prepared_dataset(
+    variables=['municipality_name'],
     datasets=dict(
-        ghg_emissions='jyrjola/hsy/pks_khk_paastot',
+        ghg_emissions=dict(
+            path='jyrjola/hsy/pks_khk_paastot',
+            columns=['Vuosi', 'Sektori2', 'Energiankulutus'],
+            filters=[('Kaupunki', '==', Variable('municipality_name')), ('Sektori2', '==', 'Maalämpö')],
+        ),
     ),
 )
-def get_historical_production(datasets):
+def get_historical_production(variables, datasets):
     df = datasets['ghg_emissions']
-    df = df[df.Kaupunki == 'Helsinki'].drop(columns='Kaupunki')
-    df = df[df.Sektori2 == 'Maalämpö'].groupby(['Vuosi', 'Sektori2']).sum()
+    df = df.groupby(['Vuosi', 'Sektori2']).sum()
     df = df.reset_index().set_index('Vuosi')
     return df['Energiankulutus']
 
@@ -57,6 +62,7 @@ def get_historical_production(datasets):
     funcs=[
         generate_building_floor_area_forecast,
         generate_heat_use_per_net_area_forecast_existing_buildings,
+        generate_heat_use_per_net_area_forecast_new_buildings,
         calc_district_heating_unit_emissions_forecast,
         predict_electricity_emission_factor,
         get_historical_production
@@ -81,11 +87,9 @@ def predict_geothermal_production(variables, datasets):
     last_area = df.loc[last_historical_year]
     dh_area = last_area.sum() * DH_PERCENTAGE
 
-    dh_left = dh_area.copy()
-    geo = pd.Series()
-    for year in range(last_historical_year + 1, target_year + 1):
-        dh_left *= (1 - yearly_renovation)
-        geo.loc[year] = float(dh_area - dh_left)
+    # The district heated area left after renovating a share of it each year
+    dh_left = compound_series(dh_area, 1 - yearly_renovation, range(last_historical_year + 1, target_year + 1))
+    geo = (dh_area - dh_left).astype(float)
 
     df = pd.DataFrame()
     df['GeoBuildingNetAreaExisting'] = geo
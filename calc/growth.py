@@ -0,0 +1,29 @@
+"""Vectorized compound growth for the yearly forecasts
+
+compound_values multiplies the previous value year after year like the
+per-year loops did and gives identical results; compound_factors may
+differ from computing each factor with ** in the last bit.
+"""
+import numpy as np
+import pandas as pd
+
+
+def percent_factor(change_perc):
+    """Yearly multiplier for a change of change_perc percent per year"""
+    return 1 + (change_perc / 100)
+
+
+def compound_factors(factor, periods):
+    """factor ** period for each of the periods"""
+    return np.power(factor, np.asarray(periods))
+
+
+def compound_values(value, factor, n):
+    """The n values after multiplying value by factor once, twice, ... n times in a row"""
+    return np.cumprod(np.concatenate(([value], np.full(n, factor))))[1:]
+
+
+def compound_series(value, factor, years):
+    """compound_values for the given years as a Series"""
+    years = list(years)
+    return pd.Series(compound_values(value, factor, len(years)), index=years)
@@ -1,22 +1,27 @@
 import pandas as pd
-from . import calcfunc
+from . import calcfunc, Variable
+
+
+FORECAST_MADE_YEAR = 2018
 
 
 @calcfunc(
     variables=['municipality_name'],
     datasets=dict(
-        pop_forecast='jyrjola/aluesarjat/hginseutu_va_ve01_vaestoennuste_pks',
+        pop_forecast=dict(
+            path='jyrjola/aluesarjat/hginseutu_va_ve01_vaestoennuste_pks',
+            columns=['Vuosi', 'Ikä', 'value'],
+            filters=[
+                ('Alue', '==', Variable('municipality_name')),
+                ('Laadintavuosi', '==', 'Laadittu %s' % FORECAST_MADE_YEAR),
+                ('Vaihtoehto', '==', 'Perusvaihtoehto'),
+                ('Sukupuoli', '==', 'Molemmat sukupuolet'),
+            ],
+        ),
     )
 )
 def get_population_forecast(variables, datasets):
-    FORECAST_MADE_YEAR = 2018
-
-    df = datasets['pop_forecast']
-    df = df.loc[df.Alue == variables['municipality_name']]
-    df = df.loc[df.Laadintavuosi == 'Laadittu %s' % FORECAST_MADE_YEAR]
-    df = df.loc[df.Vaihtoehto == 'Perusvaihtoehto']
-    df = df.loc[df.Sukupuoli == 'Molemmat sukupuolet']
-    df = df.copy()
+    df = datasets['pop_forecast'].copy()
 
     df.Vuosi = df.Vuosi.astype(int)
     df.value = df.value.astype(int)
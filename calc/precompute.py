@@ -0,0 +1,72 @@
+"""Precompute calcfunc results over the slider values declared by pages.
+
+Each slider-bound variable is varied over all of its values while the
+other variables keep their defaults, and the results are stored in the
+cache with PRECOMPUTE_TIMEOUT, so that moving a single slider from the
+default scenario is a cache lookup. Run it in the background of each
+worker with PRECOMPUTE_SLIDERS=1 (see gunicorn.conf.py) or once against
+the shared cache with:
+
+    python -m calc.precompute
+"""
+import threading
+import time
+
+from common import cache
+from variables import override_variables
+from .utils import _func_name, get_cache_key
+
+
+def precompute_variable_grid(funcs, var_name, values, timeout):
+    """Compute funcs for every value of var_name, return [(name, value, ms, error)]"""
+    timings = []
+    for value in values:
+        with override_variables(**{var_name: value}):
+            for func in funcs:
+                start = time.perf_counter()
+                try:
+                    ret = func()
+                    cache.set(get_cache_key(func), ret, timeout=timeout)
+                    error = None
+                except Exception as e:
+                    error = e
+                ms = (time.perf_counter() - start) * 1000
+                timings.append((_func_name(func), value, ms, error))
+    return timings
+
+
+def get_page_precompute_declarations():
+    from pages.routing import all_pages, load_pages
+
+    if not all_pages:
+        load_pages()
+    return [(path, page.precompute) for path, page in sorted(all_pages.items()) if page.precompute]
+
+
+def precompute_pages(timeout=None):
+    if timeout is None:
+        from common import settings
+        timeout = settings.PRECOMPUTE_TIMEOUT
+
+    start = time.perf_counter()
+    for path, decl in get_page_precompute_declarations():
+        for var_name, values in decl['variables'].items():
+            timings = precompute_variable_grid(decl['funcs'], var_name, values, timeout)
+            total = sum(x[2] for x in timings)
+            errors = [x for x in timings if x[3] is not None]
+            print('[precompute] %s %s: %d values in %.1f ms%s' % (
+                path, var_name, len(values), total, ', %d failed' % len(errors) if errors else ''
+            ))
+            for name, value, ms, error in errors:
+                print('[precompute]   %s with %s=%r failed: %r' % (name, var_name, value, error))
+    print('[precompute] done in %.1f ms' % ((time.perf_counter() - start) * 1000))
+
+
+def start_background_precompute():
+    thread = threading.Thread(target=precompute_pages, name='precompute', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    precompute_pages()
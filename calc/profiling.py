@@ -0,0 +1,189 @@
+"""Per-request calcfunc traces for debugging performance
+
+When settings.CALC_TRACE is set, the span tree of the calcfunc calls of
+each request is kept for the last CALC_TRACE_HISTORY requests and served
+from the debug endpoints:
+
+    /_calc/traces                   summary of the recorded requests and
+                                    the single-flight stats of the process
+    /_calc/traces/<id>              the spans of one request as JSON
+    /_calc/traces/<id>/flame        the spans as a flame graph
+"""
+import html
+import itertools
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import flask
+
+from common import settings
+from .utils import _get_request_memo, get_single_flight_stats
+
+
+_traces = deque(maxlen=settings.CALC_TRACE_HISTORY)
+_traces_lock = threading.Lock()
+_trace_ids = itertools.count(1)
+
+ROW_HEIGHT = 20
+STATUS_COLORS = {
+    'computed': '#f4a261',
+    'cached': '#8ecae6',
+    'memo': '#b7e4c7',
+    'waited': '#cdb4db',
+    'prepared': '#ffe066',
+    'dataset': '#adb5bd',
+}
+
+
+def _request_label():
+    # All the Dash callbacks are requested from the same path, so
+    # tell them apart by the component properties they update.
+    data = flask.request.get_json(silent=True) if flask.request.is_json else None
+    if isinstance(data, dict) and data.get('output'):
+        return '%s %s' % (flask.request.path, data['output'])
+    return flask.request.path
+
+
+def record_trace(t0):
+    """Store the spans of the calcfuncs called in the current request"""
+    memo = _get_request_memo()
+    if memo is None or not memo.trace:
+        return None
+
+    trace = dict(
+        id=next(_trace_ids),
+        request=_request_label(),
+        time=datetime.now().isoformat(timespec='seconds'),
+        ms=(time.perf_counter() - t0) * 1000,
+        stats=memo.get_stats(),
+        spans=[node.to_dict(t0) for node in memo.trace],
+    )
+    with _traces_lock:
+        _traces.append(trace)
+    return trace
+
+
+def get_traces():
+    with _traces_lock:
+        return list(_traces)
+
+
+def get_trace(trace_id):
+    for trace in get_traces():
+        if trace['id'] == trace_id:
+            return trace
+    return None
+
+
+def _flame_boxes(spans, depth, boxes):
+    for span in spans:
+        boxes.append((depth, span['start_ms'], span['ms'] or 0, span['name'], span['status'], span))
+        for ds in span['datasets']:
+            boxes.append((depth + 1, ds['start_ms'], ds['ms'], ds['path'], 'dataset', ds))
+        _flame_boxes(span['children'], depth + 1, boxes)
+    return boxes
+
+
+def _format_details(label, details):
+    lines = [label]
+    for key in ('status', 'ms', 'key_ms', 'compute_ms', 'result_bytes'):
+        val = details.get(key)
+        if val is None:
+            continue
+        if isinstance(val, float):
+            val = '%.2f' % val
+        lines.append('%s: %s' % (key, val))
+    return '\n'.join(lines)
+
+
+def render_flame_graph(trace):
+    """Render the spans of a trace as a self-contained HTML page
+
+    The boxes are placed on the time axis of the request, so the calcfuncs
+    evaluated in parallel are shown side by side on the same row.
+    """
+    boxes = _flame_boxes(trace['spans'], 0, [])
+    total_ms = max([trace['ms']] + [start + ms for _, start, ms, _, _, _ in boxes]) or 1
+    n_rows = max([depth for depth, *_ in boxes], default=0) + 1
+
+    divs = []
+    for depth, start, ms, label, status, details in boxes:
+        divs.append(
+            '<div class="box" style="left: %.3f%%; width: %.3f%%; top: %dpx; background: %s" '
+            'title="%s">%s</div>' % (
+                start / total_ms * 100, max(ms / total_ms * 100, 0.05), depth * ROW_HEIGHT,
+                STATUS_COLORS.get(status, '#dee2e6'), html.escape(_format_details(label, details)),
+                html.escape('%s (%.1f ms)' % (label, ms)),
+            )
+        )
+
+    legend = ' '.join(
+        '<span class="box legend" style="background: %s">%s</span>' % (color, status)
+        for status, color in STATUS_COLORS.items()
+    )
+    stats = ', '.join('%s %d' % (key, val) for key, val in trace['stats'].items())
+    return '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Calc trace %(id)d</title>
+<style>
+body { font-family: sans-serif; font-size: 12px; }
+.graph { position: relative; height: %(height)dpx; }
+.box { position: absolute; height: %(box_height)dpx; line-height: %(box_height)dpx; overflow: hidden;
+       white-space: nowrap; text-overflow: ellipsis; border: 1px solid #fff; padding: 0 2px;
+       box-sizing: border-box; cursor: default; }
+.legend { position: static; display: inline-block; padding: 0 6px; }
+</style>
+</head>
+<body>
+<h3>%(request)s</h3>
+<p>%(time)s, %(ms).1f ms, %(stats)s</p>
+<p>%(legend)s</p>
+<div class="graph">
+%(boxes)s
+</div>
+</body>
+</html>
+''' % dict(
+        id=trace['id'], request=html.escape(trace['request']), time=trace['time'], ms=trace['ms'],
+        stats=stats, legend=legend, boxes='\n'.join(divs),
+        height=n_rows * ROW_HEIGHT, box_height=ROW_HEIGHT,
+    )
+
+
+def init_app(app):
+    @app.before_request
+    def start_trace():
+        flask.g._calc_trace_start = time.perf_counter()
+
+    @app.after_request
+    def store_trace(response):
+        t0 = getattr(flask.g, '_calc_trace_start', None)
+        if t0 is not None:
+            record_trace(t0)
+        return response
+
+    @app.route('/_calc/traces')
+    def list_traces():
+        traces = [
+            dict(id=x['id'], request=x['request'], time=x['time'], ms=x['ms'], stats=x['stats'])
+            for x in get_traces()
+        ]
+        return flask.jsonify(traces=traces, single_flight=get_single_flight_stats())
+
+    @app.route('/_calc/traces/<int:trace_id>')
+    def show_trace(trace_id):
+        trace = get_trace(trace_id)
+        if trace is None:
+            flask.abort(404)
+        return flask.jsonify(trace)
+
+    @app.route('/_calc/traces/<int:trace_id>/flame')
+    def show_flame_graph(trace_id):
+        trace = get_trace(trace_id)
+        if trace is None:
+            flask.abort(404)
+        return render_flame_graph(trace)
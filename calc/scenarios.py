@@ -0,0 +1,109 @@
+"""Evaluate the emissions model for many scenarios at once
+
+    from calc.scenarios import evaluate_scenarios, scenario_grid
+
+    df = evaluate_scenarios(scenario_grid(
+        cars_bev_percentage=list(range(0, 101, 10)),
+        geothermal_new_building_installation_share=list(range(0, 101, 10)),
+    ))
+
+The scenarios are evaluated with a shared memo, so the results that do
+not depend on the variables changed between the scenarios (population,
+building stock, dataset preparation) are computed only once. The memo is
+replaced every SCENARIO_MEMO_SIZE scenarios to bound its memory use, and
+the calls are not traced.
+"""
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from common import settings
+from variables import override_variables
+from .utils import RequestMemo, _bound_memo, _current_node, _untraced_node
+from .emissions import predict_emissions
+
+
+def scenario_grid(**values):
+    """All the combinations of the given variable values as a list of overrides"""
+    names = list(values.keys())
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def emissions_to_long(df):
+    """Convert the output of predict_emissions to rows indexed by (Year, Sector1, Sector2)"""
+    forecast = df[('Forecast', '')]
+    df = df.drop(columns='Forecast', level=0).astype(float)
+    df.columns.names = ['Sector1', 'Sector2']
+    out = df.stack(['Sector1', 'Sector2']).to_frame('Emissions')
+    out['Forecast'] = forecast.reindex(out.index.get_level_values(0)).values
+    out.index.names = ['Year', 'Sector1', 'Sector2']
+    return out
+
+
+def _evaluate_chunk(func, to_long, chunk):
+    out = []
+    node_token = _current_node.set(_untraced_node)
+    try:
+        for start in range(0, len(chunk), settings.SCENARIO_MEMO_SIZE):
+            memo = RequestMemo()
+            token = _bound_memo.set(memo)
+            try:
+                for scenario_id, overrides in chunk[start:start + settings.SCENARIO_MEMO_SIZE]:
+                    with override_variables(**overrides):
+                        df = func()
+                    if to_long is not None:
+                        df = to_long(df)
+                    out.append((scenario_id, df))
+            finally:
+                _bound_memo.reset(token)
+                memo.close()
+    finally:
+        _current_node.reset(node_token)
+    return out
+
+
+def evaluate_scenarios(scenarios, func=predict_emissions, to_long=emissions_to_long, processes=0):
+    """Evaluate func with each of the variable overrides in scenarios
+
+    `scenarios` is a list of {variable name: value} dicts (scenario ids are
+    the list positions) or a dict of them by scenario id. With processes > 1
+    the scenarios are split into contiguous chunks evaluated in forked
+    worker processes, which inherit the datasets loaded by this one.
+
+    Returns a single DataFrame with the scenario id as the outermost index
+    level; with the defaults indexed by (Scenario, Year, Sector1, Sector2).
+    """
+    if isinstance(scenarios, dict):
+        items = list(scenarios.items())
+    else:
+        items = list(enumerate(scenarios))
+
+    if processes and processes > 1 and len(items) > 1:
+        # Load the datasets and the shared results before forking
+        func()
+        n_chunks = min(processes, len(items))
+        size = -(-len(items) // n_chunks)
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        ctx = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=n_chunks, mp_context=ctx) as executor:
+            futures = [executor.submit(_evaluate_chunk, func, to_long, chunk) for chunk in chunks]
+            results = [res for future in futures for res in future.result()]
+    else:
+        results = _evaluate_chunk(func, to_long, items)
+
+    return pd.concat([df for _, df in results], keys=[scenario_id for scenario_id, _ in results], names=['Scenario'])
+
+
+if __name__ == '__main__':
+    import time
+
+    scenarios = scenario_grid(
+        cars_bev_percentage=[0, 50, 100],
+        geothermal_new_building_installation_share=[0, 50, 100],
+    )
+    start = time.perf_counter()
+    df = evaluate_scenarios(scenarios)
+    print('%d scenarios in %.1f s' % (len(scenarios), time.perf_counter() - start))
+    print(df.xs(2035, level='Year').groupby('Scenario').Emissions.sum())
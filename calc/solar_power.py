@@ -1,20 +1,21 @@
 import pandas as pd
-from . import calcfunc
+from . import calcfunc, Variable
 from .buildings import generate_building_floor_area_forecast
 
 
 @calcfunc(
     datasets=dict(
-        building_potential='jyrjola/hsy/buildings',
+        building_potential=dict(
+            path='jyrjola/hsy/buildings',
+            filters=[('kuntanimi', '==', Variable('municipality_name')), ('kerrosala', '>', 0)],
+        ),
     ),
     variables=[
         'municipality_name',
     ]
 )
 def prepare_existing_building_pv_potential_dataset(variables, datasets):
-    muni_name = variables['municipality_name']
-    df = datasets['building_potential']
-    return df.loc[(df.kuntanimi == muni_name) & (df.kerrosala > 0)].copy()
+    return datasets['building_potential'].copy()
 
 
 @calcfunc(
@@ -1,17 +1,60 @@
+import contextvars
 import importlib
 import hashlib
+import logging
 import os
-import json
+import pkgutil
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from functools import wraps
 
-from variables import get_variable
-from utils.quilt import load_datasets
-from utils.perf import PerfCounter
+import flask
 
-from common import cache
+from variables import get_variable, get_scenario, use_scenario
+from utils import copy_value
+from utils.data import FILTER_OPS
+from utils.dataset_store import get_store, load_dataset, load_dataset_partitions
 
+from common import cache, settings
+from common.serializers import ArrowSerializer
+
+
+logger = logging.getLogger(__name__)
 
 _dataset_cache = {}
+_all_calcfuncs = []
+_func_hash_data = {}
+_undeclared_calls = set()
+_code_hash = None
+
+# The calcfunc node being evaluated and the list collecting the trace
+_current_node = contextvars.ContextVar('calc_node', default=None)
+_trace_roots = contextvars.ContextVar('calc_trace', default=None)
+# The request memo when running outside of the request's thread
+_bound_memo = contextvars.ContextVar('calc_memo', default=None)
+
+# Results being computed, by cache key
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+_flight_stats = dict(computed=0, local_waits=0, shared_waits=0, wait_timeouts=0, wait_ms=0.0, max_wait_ms=0.0)
+_flight_stats_lock = threading.Lock()
+
+_executor = None
+_executor_pid = None
+_executor_workers = None
+
+# Variables a prepared dataset may depend on; they select the data
+# instead of changing the scenario
+PREPARED_DATASET_VARIABLES = ('municipality_name',)
+
+# A dataset declaration; columns and filters are pushed down to the reader
+DatasetSpec = namedtuple('DatasetSpec', ['path', 'columns', 'filters'])
+# Filter value taken from a variable when the calcfunc is called
+Variable = namedtuple('Variable', ['name'])
 
 
 def ensure_imported(func):
@@ -24,12 +67,140 @@ def ensure_imported(func):
     return func
 
 
+def load_calc_modules():
+    """Import all calc modules so that every calcfunc gets registered"""
+    import calc
+
+    for mod_info in pkgutil.iter_modules(calc.__path__):
+        importlib.import_module('calc.%s' % mod_info.name)
+
+
+def get_declared_dataset_specs():
+    load_calc_modules()
+    specs = set()
+    for func in _all_calcfuncs:
+        if func.datasets:
+            specs.update(func.datasets.values())
+    return specs
+
+
+def get_declared_datasets():
+    return set(spec.path for spec in get_declared_dataset_specs())
+
+
+def get_dataset_selections():
+    """The (filters, partition columns) each dataset is loaded with, for the dataset store"""
+    selections = {}
+    for spec in sorted(get_declared_dataset_specs(), key=repr):
+        if not spec.filters:
+            continue
+        filters, partition_filters = _split_dataset_filters(spec)
+        if any(isinstance(val, Variable) for _, _, val in filters):
+            # Selected by the current value of a variable
+            continue
+        selection = (filters, [col for col, _ in partition_filters])
+        if selection not in selections.setdefault(spec.path, []):
+            selections[spec.path].append(selection)
+    return selections
+
+
+def _make_dataset_spec(ds):
+    if isinstance(ds, str):
+        return DatasetSpec(ds, None, ())
+
+    assert isinstance(ds, dict) and 'path' in ds
+    columns = ds.get('columns')
+    if columns is not None:
+        columns = tuple(columns)
+    filters = []
+    for col, op, val in ds.get('filters', []):
+        assert op in FILTER_OPS
+        if isinstance(val, Variable):
+            get_variable(val.name)
+        elif isinstance(val, (list, tuple)):
+            val = tuple(val)
+        filters.append((col, op, val))
+    return DatasetSpec(ds['path'], columns, tuple(filters))
+
+
+def _is_partition_filter(op, val):
+    # The == filters on variables (e.g. the municipality) partition the dataset
+    return op == '==' and isinstance(val, Variable)
+
+
+def _resolve_dataset_spec(spec, partitioned=False):
+    """Replace the variables in the filters with their values
+
+    With partitioned, the == filters on variables are kept, and the
+    dataset is loaded as DatasetPartitions.
+    """
+    if not any(isinstance(val, Variable) for _, _, val in spec.filters):
+        return spec
+    filters = []
+    for col, op, val in spec.filters:
+        if isinstance(val, Variable) and not (partitioned and _is_partition_filter(op, val)):
+            val = get_variable(val.name)
+            if isinstance(val, list):
+                val = tuple(val)
+        filters.append((col, op, val))
+    return spec._replace(filters=tuple(filters))
+
+
+class DatasetPartitions:
+    """A dataset split by the values of the columns of its variable filters
+
+    The dataset is loaded and split only once, so selecting the rows
+    for another value (e.g. another municipality) is a dict lookup.
+    """
+
+    def __init__(self, partitions, empty, variables):
+        self.partitions = partitions
+        self.empty = empty
+        self.variables = variables
+
+    def get(self):
+        """The rows matching the current values of the variables"""
+        values = [get_variable(var_name) for var_name in self.variables]
+        key = values[0] if len(values) == 1 else tuple(values)
+        return self.partitions.get(key, self.empty)
+
+
+def _split_dataset_filters(spec):
+    """Split the filters of spec to the static filters and the (column, variable name) partition filters"""
+    partition_filters = [(col, val.name) for col, op, val in spec.filters if _is_partition_filter(op, val)]
+    filters = [
+        (col, op, list(val) if isinstance(val, tuple) else val) for col, op, val in spec.filters
+        if not _is_partition_filter(op, val)
+    ]
+    return filters, partition_filters
+
+
+def _load_dataset_spec(spec):
+    filters, partition_filters = _split_dataset_filters(spec)
+    if not partition_filters:
+        return load_dataset(spec.path, columns=spec.columns, filters=filters)
+
+    partitions, empty = load_dataset_partitions(
+        spec.path, [col for col, _ in partition_filters], columns=spec.columns, filters=filters
+    )
+    return DatasetPartitions(partitions, empty, [var_name for _, var_name in partition_filters])
+
+
+def _get_loaded_dataset(spec):
+    dataset = _dataset_cache[spec]
+    if isinstance(dataset, DatasetPartitions):
+        return dataset.get()
+    return dataset
+
+
 def _get_func_hash_data(func, seen_funcs):
     if seen_funcs is None:
         seen_funcs = set([func])
 
     variables = func.variables or {}
     all_variables = set(variables.values())
+    for spec in (func.datasets or {}).values():
+        all_variables.update(val.name for _, _, val in spec.filters if isinstance(val, Variable))
 
     children = func.calcfuncs or []
     children = [ensure_imported(x) for x in children]
@@ -48,28 +219,398 @@ def _get_func_hash_data(func, seen_funcs):
     return dict(variables=all_variables, funcs=all_funcs)
 
 
+def _func_name(func):
+    return '.'.join((func.__module__, func.__name__))
+
+
 def _hash_funcs(funcs):
+    # Hash in a stable order so that all worker processes agree on the keys.
+    # Hash the code of the wrapped function instead of the calcfunc wrapper.
     m = hashlib.md5()
-    for f in funcs:
+    for f in sorted(funcs, key=_func_name):
+        f = getattr(f, '__wrapped__', f)
         m.update(f.__code__.co_code)
+        if getattr(f, 'datasets', None):
+            # The dataset projections and filters change the input data
+            m.update(repr(sorted(f.datasets.items())).encode())
     return m.hexdigest()
 
 
+def get_func_hash_data(func):
+    # The transitive variables and calcfuncs and the hash of their code
+    # do not change during the lifetime of the process, so they are
+    # resolved only once per calcfunc.
+    data = _func_hash_data.get(func)
+    if data is not None:
+        return data
+
+    hash_data = _get_func_hash_data(func, None)
+    data = dict(
+        name=_func_name(func),
+        variables=tuple(sorted(hash_data['variables'])),
+        children=tuple(ensure_imported(x) for x in func.calcfuncs or []),
+        funcs=frozenset(hash_data['funcs']),
+        func_hash=_hash_funcs(hash_data['funcs']),
+    )
+    _func_hash_data[func] = data
+    return data
+
+
+def get_code_hash():
+    """Hash of the code of all calcfuncs; changes whenever any calculation changes"""
+    global _code_hash
+
+    if _code_hash is None:
+        load_calc_modules()
+        _code_hash = _hash_funcs(_all_calcfuncs)
+    return _code_hash
+
+
+def resolve_calcfuncs():
+    """Resolve the dependency data of every calcfunc defined so far."""
+    for func in _all_calcfuncs:
+        get_func_hash_data(func)
+
+
 def _calculate_cache_key(func, hash_data):
-    funcs = hash_data['funcs']
-    variables = hash_data['variables']
-    var_data = json.dumps({x: get_variable(x) for x in variables}, sort_keys=True)
+    # The scenario hashes each subset of variables only once
+    var_hash = get_scenario().subset_hash(hash_data['variables'])
+    return '%s:%s:%s' % (hash_data['name'], var_hash, hash_data['func_hash'])
+
+
+def get_cache_key(func):
+    """Cache key of the result of calcfunc `func` with the current variable values"""
+    return _calculate_cache_key(func, get_func_hash_data(func))
+
+
+class CalcNode:
+    """One calcfunc call in a trace: whether it was reused or recomputed
+
+    Nodes are created only when settings.CALC_TRACE is set or within
+    trace_calcfuncs(). The timings of the cache key, the dataset loads and
+    the function body and the size of the result are recorded only when
+    settings.CALC_TRACE is set.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        # 'memo', 'cached', 'waited' (for another thread), 'prepared' (loaded from disk) or 'computed'
+        self.status = None
+        self.ms = None
+        self.children = []
+        self.start = None
+        self.token = None
+        self.key_ms = None
+        self.compute_ms = None
+        self.result_bytes = None
+        self.datasets = []  # (path, start, ms) of the datasets loaded for the call
+
+    @property
+    def name(self):
+        return _func_name(self.func)
+
+    def to_dict(self, t0):
+        """The span tree of the call as JSON-serializable dicts, times in ms from t0"""
+        return dict(
+            name=self.name,
+            status=self.status,
+            start_ms=(self.start - t0) * 1000,
+            ms=self.ms,
+            key_ms=self.key_ms,
+            compute_ms=self.compute_ms,
+            result_bytes=self.result_bytes,
+            datasets=[
+                dict(path=path, start_ms=(start - t0) * 1000, ms=ms) for path, start, ms in self.datasets
+            ],
+            children=[child.to_dict(t0) for child in self.children],
+        )
+
+
+class _UntracedNode:
+    """Stands in for the CalcNode of every call when nothing is traced"""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_untraced_node = _UntracedNode()
+
+
+def _enter_node(func):
+    if not settings.CALC_TRACE and _trace_roots.get() is None:
+        return _untraced_node
+    parent = _current_node.get()
+    if parent is _untraced_node:
+        # Within a prefetch
+        return _untraced_node
+    node = CalcNode(func)
+    if parent is not None:
+        parent.children.append(node)
+        if func not in get_func_hash_data(parent.func)['funcs'] and (parent.func, func) not in _undeclared_calls:
+            # The variables of the callee are then missing from the cache key of the caller
+            _undeclared_calls.add((parent.func, func))
+            logger.warning('%s calls %s, which is not declared in its funcs' % (parent.name, node.name))
+    else:
+        roots = _trace_roots.get()
+        if roots is not None:
+            roots.append(node)
+        memo = _get_request_memo()
+        if memo is not None:
+            memo.trace.append(node)
+    node.start = time.perf_counter()
+    node.token = _current_node.set(node)
+    return node
+
+
+def _exit_node(node):
+    if node is _untraced_node:
+        return
+    _current_node.reset(node.token)
+    node.ms = (time.perf_counter() - node.start) * 1000
+
+
+@contextmanager
+def trace_calcfuncs():
+    """Collect the calcfunc calls made within the block as trees of CalcNodes"""
+    roots = []
+    token = _trace_roots.set(roots)
+    try:
+        yield roots
+    finally:
+        _trace_roots.reset(token)
+
+
+def _format_nodes(nodes, indent):
+    lines = []
+    for node in nodes:
+        lines.append('%s%-8s %8.1f ms  %s' % ('  ' * indent, node.status, node.ms or 0, node.name))
+        lines += _format_nodes(node.children, indent + 1)
+    return lines
+
+
+def format_trace(nodes):
+    """Show which calcfuncs were recomputed and which were reused"""
+    lines = _format_nodes(nodes, 0)
+    recomputed = len([x for x in lines if x.lstrip().startswith('computed')])
+    lines.append('%d calcfuncs recomputed, %d reused' % (recomputed, len(lines) - recomputed))
+    return '\n'.join(lines)
+
+
+class RequestMemo:
+    def __init__(self):
+        self.results = {}
+        self.trace = []
+        self.memo_hits = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Futures of the dependencies being prefetched for the request
+        self.prefetches = set()
+        self.closed = False
+
+    def close(self):
+        """Cancel the prefetches that have not started yet, at the end of the request"""
+        self.closed = True
+        for future in list(self.prefetches):
+            future.cancel()
+
+    def get_stats(self):
+        return dict(
+            memo_hits=self.memo_hits,
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
+        )
+
+
+def _get_request_memo():
+    memo = _bound_memo.get()
+    if memo is not None:
+        return memo
+    if not flask.has_request_context():
+        return None
+    memo = getattr(flask.g, '_calc_memo', None)
+    if memo is None:
+        memo = flask.g._calc_memo = RequestMemo()
+    return memo
+
+
+def get_request_calc_stats():
+    memo = _get_request_memo()
+    if memo is None:
+        return None
+    return memo.get_stats()
+
+
+def set_parallel_workers(max_workers):
+    """Evaluate the calcfuncs a calcfunc depends on with up to max_workers threads (0 = serially)"""
+    global _executor, _executor_workers
+
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    _executor_workers = max_workers
+
+
+def _get_executor():
+    global _executor, _executor_pid, _executor_workers
+
+    if _executor_workers is None:
+        _executor_workers = settings.CALC_PARALLEL_WORKERS
+    if not _executor_workers:
+        return None
+    # The threads of an executor do not survive a fork
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=_executor_workers, thread_name_prefix='calc')
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _prefetch_funcs(executor, funcs):
+    # Start computing the dependencies in the background. The caller then
+    # calls them itself as usual and either finds the results in the memo
+    # and the cache or waits for the computation in progress. Nobody waits
+    # for tasks that have not started yet, so a full pool cannot deadlock.
+    # The prefetches are not traced, the trace has the caller's own calls.
+    scenario = get_scenario()
+    memo = _get_request_memo()
+    if memo is not None and memo.closed:
+        return
+
+    def run(func):
+        token = _bound_memo.set(memo)
+        node_token = _current_node.set(_untraced_node)
+        try:
+            with use_scenario(scenario):
+                func()
+        finally:
+            _current_node.reset(node_token)
+            _bound_memo.reset(token)
+
+    for func in funcs:
+        ctx = contextvars.copy_context()
+        future = executor.submit(ctx.run, run, func)
+        if memo is not None:
+            memo.prefetches.add(future)
+            future.add_done_callback(memo.prefetches.discard)
+
+
+def _record_wait(kind, start, timed_out):
+    ms = (time.perf_counter() - start) * 1000
+    with _flight_stats_lock:
+        _flight_stats[kind] += 1
+        _flight_stats['wait_ms'] += ms
+        _flight_stats['max_wait_ms'] = max(_flight_stats['max_wait_ms'], ms)
+        if timed_out:
+            _flight_stats['wait_timeouts'] += 1
+
+
+def get_single_flight_stats():
+    with _flight_stats_lock:
+        return dict(_flight_stats)
+
+
+def _wait_for_shared_result(cache_key, timeout):
+    # Poll the cache until the worker holding the lock stores the result,
+    # returns (result, timed_out). The result is None if the lock was
+    # released without a result (e.g. the computation failed).
+    # The polls are not counted in the cache hit and miss stats.
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while True:
+        ret = cache.peek(cache_key)
+        if ret is not None:
+            return ret, False
+        if not cache.is_locked(cache_key):
+            return cache.peek(cache_key), False
+        if time.monotonic() >= deadline:
+            return None, True
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+
+
+def _compute_single_flight(cache_key, compute_func):
+    """Compute and cache the result unless another process is already computing it
+
+    Returns the result and whether it was computed here.
+    """
+    for attempt in range(3):
+        token = cache.acquire_lock(cache_key, settings.CALC_LOCK_TIMEOUT)
+        if token is not None:
+            try:
+                ret = compute_func()
+                assert ret is not None
+                cache.set(cache_key, ret, timeout=600)
+            finally:
+                cache.release_lock(cache_key, token)
+            with _flight_stats_lock:
+                _flight_stats['computed'] += 1
+            return ret, True
+
+        start = time.perf_counter()
+        ret, timed_out = _wait_for_shared_result(cache_key, settings.CALC_LOCK_WAIT_TIMEOUT)
+        _record_wait('shared_waits', start, timed_out)
+        if ret is not None:
+            return ret, False
+        if timed_out:
+            logger.warning('Timed out waiting for another process to compute %s' % cache_key)
+            break
+
+    # Give up on the lock and compute the result here
+    ret = compute_func()
+    assert ret is not None
+    cache.set(cache_key, ret, timeout=600)
+    with _flight_stats_lock:
+        _flight_stats['computed'] += 1
+    return ret, True
+
+
+def _get_prepared_dataset_path(func, variable_values):
+    # Prepared datasets are stored per dataset store version, so they are
+    # never read from an older version of the datasets.
+    version = get_store().version
+    if version is None:
+        return None
+    hash_data = get_func_hash_data(func)
+    m = hashlib.md5()
+    m.update(hash_data['func_hash'].encode())
+    m.update(repr(sorted((variable_values or {}).items())).encode())
+    return os.path.join(
+        settings.PREPARED_DATASET_DIR, version, '%s-%s.bin' % (hash_data['name'], m.hexdigest())
+    )
+
 
-    func_hash = _hash_funcs(funcs)
-    func_name = '.'.join((func.__module__, func.__name__))
-    return '%s:%s:%s' % (func_name, hashlib.md5(var_data.encode()).hexdigest(), func_hash)
+def _load_prepared_dataset(path):
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return ArrowSerializer().loads(f.read())
 
 
-def calcfunc(variables=None, datasets=None, funcs=None):
+def _save_prepared_dataset(path, val):
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        # Written only once per dataset version, so the round trip is checked
+        f.write(ArrowSerializer(verify=True).dumps(val))
+    os.replace(tmp_path, path)
+
+
+def has_prepared_dataset(func):
+    """Whether the result of prepared dataset `func` is stored on disk for the current variable values"""
+    variable_values = {x: get_variable(y) for x, y in (func.variables or {}).items()}
+    path = _get_prepared_dataset_path(func, variable_values)
+    return path is not None and os.path.exists(path)
+
+
+def calcfunc(variables=None, datasets=None, funcs=None, prepared=False):
     if datasets is not None:
         assert isinstance(datasets, (list, tuple, dict))
         if not isinstance(datasets, dict):
             datasets = {x: x for x in datasets}
+        datasets = {name: _make_dataset_spec(ds) for name, ds in datasets.items()}
 
     if variables is not None:
         assert isinstance(variables, (list, tuple, dict))
@@ -89,17 +630,22 @@ def calcfunc(variables=None, datasets=None, funcs=None):
         func.variables = variables
         func.datasets = datasets
         func.calcfuncs = funcs
+        func.prepared = prepared
 
         @wraps(func)
         def wrap_calc_func(*args, **kwargs):
-            should_profile = os.environ.get('PROFILE_CALC', '').lower() in ('1', 'true', 'yes')
-
-            if should_profile:
-                pc = PerfCounter('%s.%s' % (func.__module__, func.__name__))
-                pc.display('enter')
-
-            hash_data = _get_func_hash_data(func, None)
-            cache_key = _calculate_cache_key(func, hash_data)
+            # Each call is a node in the trace; a node whose result is found
+            # in the memo or the cache is reused with its whole subtree.
+            node = _enter_node(wrap_calc_func)
+            try:
+                return call_calc_func(node, *args, **kwargs)
+            finally:
+                _exit_node(node)
+
+        def call_calc_func(node, *args, **kwargs):
+            # Prefetched and batch calls run on the untraced node even when
+            # tracing is on, so nothing may be recorded on it.
+            tracing = settings.CALC_TRACE and node is not _untraced_node
 
             assert 'variables' not in kwargs
             assert 'datasets' not in kwargs
@@ -110,42 +656,164 @@ def calcfunc(variables=None, datasets=None, funcs=None):
                 should_cache_func = False
 
             if should_cache_func:
+                if tracing:
+                    start = time.perf_counter()
+                hash_data = get_func_hash_data(wrap_calc_func)
+                cache_key = _calculate_cache_key(func, hash_data)
+                if tracing:
+                    node.key_ms = (time.perf_counter() - start) * 1000
+
+                memo = _get_request_memo()
+                if memo is not None:
+                    ret = memo.results.get(cache_key)
+                    if ret is not None:
+                        memo.memo_hits += 1
+                        node.status = 'memo'
+                        return copy_value(ret)
+
                 ret = cache.get(cache_key)
                 if ret is not None:  # calcfuncs must not return None
-                    if should_profile:
-                        pc.display('cache hit')
+                    if memo is not None:
+                        memo.cache_hits += 1
+                        memo.results[cache_key] = copy_value(ret)
+                    node.status = 'cached'
+                    return ret
+                if memo is not None:
+                    memo.cache_misses += 1
+
+                # Compute each result only once at a time in this process
+                # (and in all processes sharing the cache, see _compute_single_flight)
+                with _in_flight_lock:
+                    in_flight = _in_flight.get(cache_key)
+                    if in_flight is None:
+                        _in_flight[cache_key] = own_flight = Future()
+                if in_flight is not None:
+                    start = time.perf_counter()
+                    try:
+                        ret = copy_value(in_flight.result(timeout=settings.CALC_LOCK_WAIT_TIMEOUT))
+                    except FutureTimeoutError:
+                        _record_wait('local_waits', start, True)
+                        logger.warning('Timed out waiting for another thread to compute %s' % cache_key)
+                        return compute(node, tracing, args, kwargs)
+                    _record_wait('local_waits', start, False)
+                    node.status = 'waited'
                     return ret
 
+                try:
+                    ret, computed = _compute_single_flight(
+                        cache_key, lambda: compute(node, tracing, args, kwargs)
+                    )
+                    if not computed:
+                        node.status = 'waited'
+                    if memo is not None:
+                        memo.results[cache_key] = copy_value(ret)
+                except BaseException as e:
+                    own_flight.set_exception(e)
+                    raise
+                else:
+                    own_flight.set_result(copy_value(ret))
+                finally:
+                    with _in_flight_lock:
+                        del _in_flight[cache_key]
+                return ret
+
+            return compute(node, tracing, args, kwargs)
+
+        def compute(node, tracing, args, kwargs):
+            executor = _get_executor()
+            if executor is not None and funcs:
+                _prefetch_funcs(executor, get_func_hash_data(wrap_calc_func)['children'])
+
             if variables is not None:
                 kwargs['variables'] = {x: get_variable(y) for x, y in variables.items()}
 
+            if prepared:
+                prepared_path = _get_prepared_dataset_path(wrap_calc_func, kwargs.get('variables'))
+                ret = _load_prepared_dataset(prepared_path)
+                if ret is not None:
+                    node.status = 'prepared'
+                    return ret
+
             if datasets is not None:
-                datasets_to_load = set(list(datasets.values())) - set(_dataset_cache.keys())
+                specs = {ds_name: _resolve_dataset_spec(spec, partitioned=True) for ds_name, spec in datasets.items()}
+                datasets_to_load = set(specs.values()) - set(_dataset_cache.keys())
                 if datasets_to_load:
                     loaded_datasets = []
-                    for dataset_name in datasets_to_load:
-                        if should_profile:
-                            ds_pc = PerfCounter('dataset %s' % dataset_name)
-                        df = load_datasets(dataset_name)
-                        if should_profile:
-                            ds_pc.display('loaded')
-                            del ds_pc
+                    for spec in datasets_to_load:
+                        start = time.perf_counter()
+                        df = _load_dataset_spec(spec)
+                        if tracing:
+                            node.datasets.append((spec.path, start, (time.perf_counter() - start) * 1000))
                         loaded_datasets.append(df)
 
-                    for dataset_name, dataset in zip(datasets_to_load, loaded_datasets):
-                        _dataset_cache[dataset_name] = dataset
+                    for spec, dataset in zip(datasets_to_load, loaded_datasets):
+                        _dataset_cache[spec] = dataset
 
-                kwargs['datasets'] = {ds_name: _dataset_cache[ds_url] for ds_name, ds_url in datasets.items()}
+                kwargs['datasets'] = {ds_name: _get_loaded_dataset(spec) for ds_name, spec in specs.items()}
 
+            node.status = 'computed'
+            if tracing:
+                start = time.perf_counter()
             ret = func(*args, **kwargs)
-            if should_profile:
-                pc.display('func ret')
-            if should_cache_func:
-                assert ret is not None
-                cache.set(cache_key, ret, timeout=600)
-
+            if tracing:
+                node.compute_ms = (time.perf_counter() - start) * 1000
+                node.result_bytes = cache.estimate_size(ret)
+            if prepared:
+                _save_prepared_dataset(prepared_path, ret)
             return ret
 
+        _all_calcfuncs.append(wrap_calc_func)
         return wrap_calc_func
 
     return wrapper_factory
+
+
+def prepared_dataset(datasets, variables=None):
+    """A calcfunc preparing raw datasets for the scenario calculations
+
+    The result may depend only on the datasets and on the variables in
+    PREPARED_DATASET_VARIABLES. It is computed once per dataset store
+    version and variable values and stored in PREPARED_DATASET_DIR, where
+    the other workers and later runs load it from.
+    """
+    names = []
+    if variables is not None:
+        names = variables.values() if isinstance(variables, dict) else variables
+        for var_name in names:
+            assert var_name in PREPARED_DATASET_VARIABLES, \
+                'Prepared datasets must not depend on the scenario variable %s' % var_name
+    # The stored file is selected by the values of the declared variables
+    # only, so the variables filtering the datasets must be declared too.
+    for ds in datasets.values():
+        for _, _, val in (ds.get('filters', []) if isinstance(ds, dict) else []):
+            assert not isinstance(val, Variable) or val.name in names, \
+                'Dataset filter variable %s must be declared in the variables of the prepared dataset' % val.name
+    return calcfunc(variables=variables, datasets=datasets, prepared=True)
+
+
+def init_app(app):
+    if settings.CALC_TRACE:
+        from . import profiling
+
+        profiling.init_app(app)
+
+    @app.teardown_request
+    def close_request_memo(exc):
+        memo = getattr(flask.g, '_calc_memo', None)
+        if memo is not None:
+            memo.close()
+
+    @app.after_request
+    def print_calc_stats(response):
+        if settings.CALC_STATS_HEADER:
+            stats = get_request_calc_stats()
+            if stats:
+                response.headers['X-Calc-Stats'] = '; '.join('%s=%d' % x for x in sorted(stats.items()))
+        if settings.PROFILE_CALC:
+            stats = get_request_calc_stats()
+            if stats and any(stats.values()):
+                print('[calc] %s: %d memo hits (backend lookups avoided), %d cache hits, %d cache misses' % (
+                    flask.request.path, stats['memo_hits'], stats['cache_hits'], stats['cache_misses']
+                ))
+                print(format_trace(_get_request_memo().trace))
+        return response
@@ -0,0 +1,96 @@
+"""Warm up a worker process before it serves requests.
+
+Loads every dataset declared by the calcfuncs in parallel and computes
+all the calcfuncs with the default variable values, which populates
+the dataset cache and the result cache. Run it from the gunicorn hooks
+in gunicorn.conf.py (enabled with WARMUP=1) or manually with:
+
+    python -m calc.warmup
+"""
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import (
+    _all_calcfuncs, _dataset_cache, _func_name, _load_dataset_spec, _resolve_dataset_spec,
+    get_func_hash_data, has_prepared_dataset, load_calc_modules
+)
+
+
+def _is_zero_arg(func):
+    params = inspect.signature(func.__wrapped__).parameters
+    for name, param in params.items():
+        if name in ('variables', 'datasets'):
+            continue
+        if param.default is param.empty and param.kind not in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            return False
+    return True
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    try:
+        func(*args)
+        error = None
+    except Exception as e:
+        error = e
+    return (time.perf_counter() - start) * 1000, error
+
+
+def load_all_datasets(max_workers=4):
+    """Load the datasets of all calcfuncs in parallel, return [(path, ms, error)]"""
+    specs = set()
+    for func in _all_calcfuncs:
+        if func.prepared and has_prepared_dataset(func):
+            # Loaded from disk instead of being prepared from the datasets
+            continue
+        for spec in (func.datasets or {}).values():
+            specs.add(_resolve_dataset_spec(spec, partitioned=True))
+    specs = sorted(specs - set(_dataset_cache.keys()), key=repr)
+
+    def load(spec):
+        _dataset_cache[spec] = _load_dataset_spec(spec)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda spec: _timed(load, spec), specs)
+        return [(spec.path, ms, error) for spec, (ms, error) in zip(specs, results)]
+
+
+def compute_all_calcfuncs():
+    """Compute every zero-argument calcfunc, dependencies first, return [(name, ms, error)]"""
+    funcs = [func for func in _all_calcfuncs if _is_zero_arg(func)]
+    funcs.sort(key=lambda func: len(get_func_hash_data(func)['funcs']))
+    return [(_func_name(func),) + _timed(func) for func in funcs]
+
+
+def _print_timings(title, timings):
+    total = sum(ms for _, ms, _ in timings)
+    print('[warmup] %s: %d in %.1f ms' % (title, len(timings), total))
+    for name, ms, error in sorted(timings, key=lambda x: -x[1]):
+        print('[warmup]   %8.1f ms  %s%s' % (ms, name, '  FAILED: %r' % error if error else ''))
+
+
+def warm_up(max_workers=None):
+    """Warm up the dataset and result caches and print the timing of each step"""
+    if max_workers is None:
+        from common import settings
+        max_workers = settings.WARMUP_THREADS
+
+    start = time.perf_counter()
+    load_calc_modules()
+    print('[warmup] imported calc modules in %.1f ms' % ((time.perf_counter() - start) * 1000))
+
+    step_start = time.perf_counter()
+    dataset_timings = load_all_datasets(max_workers)
+    print('[warmup] loaded datasets in %.1f ms (wall)' % ((time.perf_counter() - step_start) * 1000))
+    _print_timings('datasets', dataset_timings)
+
+    func_timings = compute_all_calcfuncs()
+    _print_timings('calcfuncs', func_timings)
+
+    print('[warmup] done in %.1f ms' % ((time.perf_counter() - start) * 1000))
+    return dict(datasets=dataset_timings, calcfuncs=func_timings)
+
+
+if __name__ == '__main__':
+    warm_up()
@@ -1,26 +1,245 @@
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
 import pandas as pd
 from flask_caching import Cache
 
+from utils import copy_value
+
 
 _cache_backend = None
 
 
+def estimate_size(val):
+    if isinstance(val, tuple):
+        return sum(estimate_size(x) for x in val)
+    if isinstance(val, pd.DataFrame):
+        return int(val.memory_usage(index=True, deep=True).sum())
+    if isinstance(val, pd.Series):
+        return int(val.memory_usage(index=True, deep=True))
+    return sys.getsizeof(val)
+
+
+class LocalLRUCache:
+    """In-process cache bounded by the approximate memory usage of its values"""
+
+    def __init__(self, max_bytes, default_timeout=300):
+        self.max_bytes = max_bytes
+        self.default_timeout = default_timeout
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = dict(hits=0, misses=0, sets=0, evictions=0, expirations=0)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            expires, _, val = entry
+            if expires is not None and expires <= time.monotonic():
+                self._remove(key)
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return copy_value(val)
+
+    def peek(self, key):
+        """Like get() but without counting the lookup or refreshing the entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, _, val = entry
+            if expires is not None and expires <= time.monotonic():
+                return None
+        return copy_value(val)
+
+    def set(self, key, val, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = time.monotonic() + timeout if timeout else None
+        size = estimate_size(val)
+        if size > self.max_bytes:
+            return False
+        val = copy_value(val)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, size, val)
+            self.size += size
+            self.stats['sets'] += 1
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats['evictions'] += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self.size, max_bytes=self.max_bytes)
+
+
+class RedisLocks:
+    """Locks shared by all processes using the same Redis"""
+
+    RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, client, key_prefix):
+        self.client = client
+        self.key_prefix = '%slock:' % key_prefix
+
+    def acquire(self, key, timeout):
+        """Return a token if the lock was acquired, otherwise None"""
+        token = uuid.uuid4().hex
+        if self.client.set(self.key_prefix + key, token, nx=True, px=int(timeout * 1000)):
+            return token
+        return None
+
+    def release(self, key, token):
+        # Only delete the lock if it has not expired and been taken by someone else
+        self.client.eval(self.RELEASE_SCRIPT, 1, self.key_prefix + key, token)
+
+    def is_locked(self, key):
+        return bool(self.client.exists(self.key_prefix + key))
+
+
+# Server-wide counters from Redis INFO reported with the shared cache stats
+REDIS_INFO_STATS = ('evicted_keys', 'expired_keys', 'used_memory', 'maxmemory')
+
+
+class TieredCache:
+    """Local LRU cache in front of an optional shared cache (write-through)"""
+
+    def __init__(self, local, remote=None, locks=None, redis_client=None):
+        self.local = local
+        self.remote = remote
+        self.locks = locks
+        self.redis_client = redis_client
+        self.remote_stats = dict(hits=0, misses=0, sets=0)
+        self._stats_lock = threading.Lock()
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self.remote_stats[stat] += 1
+
+    def get(self, key):
+        val = self.local.get(key)
+        if val is not None or self.remote is None:
+            return val
+
+        val = self.remote.get(key)
+        if val is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        self.local.set(key, val)
+        return val
+
+    def peek(self, key):
+        # For polling (e.g. waiting for another worker to store a result),
+        # which would otherwise be counted as a miss on every poll
+        val = self.local.peek(key)
+        if val is not None or self.remote is None:
+            return val
+
+        val = self.remote.get(key)
+        if val is not None:
+            self.local.set(key, val)
+        return val
+
+    def set(self, key, val, timeout=None):
+        if self.remote is not None:
+            self.remote.set(key, val, timeout=timeout)
+            self._count('sets')
+            # Keep the local copies short-lived when there is a shared tier
+            if timeout:
+                timeout = min(timeout, self.local.default_timeout)
+            else:
+                timeout = self.local.default_timeout
+        self.local.set(key, val, timeout=timeout)
+
+    def clear(self):
+        self.local.clear()
+        if self.remote is not None:
+            self.remote.clear()
+
+    def get_stats(self):
+        stats = dict(local=self.local.get_stats())
+        if self.remote is not None:
+            with self._stats_lock:
+                stats['remote'] = dict(self.remote_stats)
+        if self.redis_client is not None:
+            # Evictions happen in Redis itself (maxmemory), so they are
+            # only visible in its server-wide counters
+            info = self.redis_client.info()
+            stats['remote'].update({key: info.get(key) for key in REDIS_INFO_STATS})
+        return stats
+
+
+def _make_redis_cache(serializer, **kwargs):
+    from flask_caching.backends.rediscache import RedisCache
+
+    class SerializingRedisCache(RedisCache):
+        def dump_object(self, value):
+            return serializer.dumps(value)
+
+        def load_object(self, value):
+            if value is None:
+                return None
+            return serializer.loads(value)
+
+    return SerializingRedisCache(**kwargs)
+
+
 def _init_local_cache():
     from common import settings
     global _cache_backend
 
-    if settings.CACHE_TYPE == 'simple':
-        from flask_caching.backends.simple import SimpleCache
-
-        _cache_backend = SimpleCache()
-    elif settings.CACHE_TYPE == 'redis':
+    local = LocalLRUCache(
+        max_bytes=settings.CACHE_LOCAL_MAX_BYTES,
+        default_timeout=settings.CACHE_LOCAL_DEFAULT_TIMEOUT,
+    )
+    remote = None
+    locks = None
+    client = None
+    if settings.CACHE_TYPE == 'redis':
         from redis import from_url as redis_from_url
-        from flask_caching.backends.rediscache import RedisCache
+        from common.serializers import get_serializer
 
-        _cache_backend = RedisCache(
+        client = redis_from_url(settings.CACHE_REDIS_URL)
+        remote = _make_redis_cache(
+            get_serializer(
+                settings.CACHE_SERIALIZER, compression=settings.CACHE_COMPRESSION,
+                verify=settings.CACHE_SERIALIZER_VERIFY,
+            ),
             key_prefix=settings.CACHE_KEY_PREFIX,
-            host=redis_from_url(settings.CACHE_REDIS_URL)
+            host=client
         )
+        locks = RedisLocks(client, settings.CACHE_KEY_PREFIX)
+
+    _cache_backend = TieredCache(local, remote, locks, redis_client=client)
 
 
 def get(key):
@@ -30,19 +249,70 @@ def get(key):
     return _cache_backend.get(key)
 
 
+def peek(key):
+    """Get the value for key without counting the lookup in the stats"""
+    if _cache_backend is None:
+        _init_local_cache()
+
+    return _cache_backend.peek(key)
+
+
 def set(key, val, timeout=None):
     if _cache_backend is None:
         _init_local_cache()
 
-    _cache_backend.set(key, val)
+    _cache_backend.set(key, val, timeout=timeout)
+
+
+def acquire_lock(key, timeout):
+    """Take the shared lock for key for at most timeout seconds
+
+    Returns a token for release_lock() or None if another process holds
+    the lock. Without a shared cache the lock is always acquired.
+    """
+    if _cache_backend is None:
+        _init_local_cache()
+
+    if _cache_backend.locks is None:
+        return 'local'
+    return _cache_backend.locks.acquire(key, timeout)
+
+
+def release_lock(key, token):
+    if _cache_backend.locks is not None:
+        _cache_backend.locks.release(key, token)
+
+
+def is_locked(key):
+    if _cache_backend is None:
+        _init_local_cache()
+
+    if _cache_backend.locks is None:
+        return False
+    return _cache_backend.locks.is_locked(key)
+
+
+def clear():
+    if _cache_backend is None:
+        _init_local_cache()
+
+    _cache_backend.clear()
+
+
+def get_stats():
+    if _cache_backend is None:
+        _init_local_cache()
+
+    return _cache_backend.get_stats()
 
 
 def init_app(app):
-    global memoize, get, set
+    global memoize
 
     _cache = Cache()
     _cache.init_app(app)
 
     memoize = _cache.memoize
-    get = _cache.get
-    set = _cache.set
+
+    if _cache_backend is None:
+        _init_local_cache()
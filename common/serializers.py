@@ -0,0 +1,154 @@
+import io
+import pickle
+
+import pandas as pd
+
+
+PICKLE = b'P'
+ARROW_FRAME = b'F'
+ARROW_SERIES = b'S'
+
+CODEC_NONE = b'-'
+CODEC_SNAPPY = b's'
+
+SERIES_COLUMN = '__series__'
+
+
+class PickleSerializer:
+    def dumps(self, val):
+        return PICKLE + CODEC_NONE + pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return loads(data)
+
+
+class ArrowSerializer:
+    """Encode DataFrames and Series as Arrow IPC streams, anything else with pickle
+
+    Values with object columns or index levels holding anything but
+    strings (which Arrow may not reproduce exactly) are pickled instead.
+    With verify, every encoded value is also decoded and compared to the
+    original, which doubles the cost of encoding; use it when debugging
+    and benchmarking.
+    """
+
+    def __init__(self, compression=None, verify=False):
+        assert compression in (None, 'snappy')
+        self.compression = compression
+        self.verify = verify
+
+    def _encode_frame(self, df):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        sink = pa.BufferOutputStream()
+        writer = pa.RecordBatchStreamWriter(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+        return sink.getvalue().to_pybytes()
+
+    def _try_encode(self, val):
+        if isinstance(val, pd.Series):
+            kind = ARROW_SERIES
+            df = val.to_frame(name=SERIES_COLUMN)
+        elif isinstance(val, pd.DataFrame):
+            kind = ARROW_FRAME
+            df = val
+        else:
+            return None, None
+
+        if not _has_arrow_safe_objects(df):
+            return None, None
+
+        try:
+            payload = self._encode_frame(df)
+        except Exception:
+            return None, None
+
+        if self.verify:
+            try:
+                out = _decode_arrow(kind, payload)
+            except Exception:
+                return None, None
+            if not _is_identical(val, out):
+                return None, None
+
+        if kind == ARROW_SERIES:
+            # The series name is not stored in the frame
+            payload = pickle.dumps(val.name) + payload
+
+        return kind, payload
+
+    def dumps(self, val):
+        kind, payload = self._try_encode(val)
+        if kind is None:
+            kind = PICKLE
+            payload = pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if self.compression == 'snappy':
+            import snappy
+            return kind + CODEC_SNAPPY + snappy.compress(payload)
+        return kind + CODEC_NONE + payload
+
+    def loads(self, data):
+        return loads(data)
+
+
+def _has_arrow_safe_objects(df):
+    # Object columns of mixed types do not survive the round trip
+    columns = [df[col] for col in df.columns if df[col].dtype == object]
+    index = df.index
+    columns += [index.get_level_values(i) for i in range(index.nlevels) if index.get_level_values(i).dtype == object]
+    return all(pd.api.types.infer_dtype(col, skipna=True) in ('string', 'empty') for col in columns)
+
+
+def _is_identical(a, b):
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, pd.DataFrame):
+        if not a.columns.equals(b.columns) or list(a.dtypes) != list(b.dtypes):
+            return False
+    elif a.dtype != b.dtype:
+        return False
+    # A RangeIndex may come back as an equal Int64Index
+    if not a.index.equals(b.index) or a.index.dtype != b.index.dtype or a.index.names != b.index.names:
+        return False
+    return a.equals(b)
+
+
+def _decode_arrow(kind, payload):
+    import pyarrow as pa
+
+    reader = pa.RecordBatchStreamReader(pa.py_buffer(payload))
+    df = reader.read_all().to_pandas()
+    if kind == ARROW_SERIES:
+        return df[SERIES_COLUMN]
+    return df
+
+
+def loads(data):
+    kind, codec, payload = data[0:1], data[1:2], data[2:]
+    if codec == CODEC_SNAPPY:
+        import snappy
+        payload = snappy.decompress(payload)
+
+    if kind == PICKLE:
+        return pickle.loads(payload)
+
+    if kind == ARROW_SERIES:
+        # The pickled name is followed by the Arrow stream
+        f = io.BytesIO(payload)
+        name = pickle.Unpickler(f).load()
+        s = _decode_arrow(kind, payload[f.tell():])
+        s.name = name
+        return s
+
+    return _decode_arrow(kind, payload)
+
+
+def get_serializer(name, compression=None, verify=False):
+    if name == 'pickle':
+        return PickleSerializer()
+    if name == 'arrow':
+        return ArrowSerializer(compression=compression, verify=verify)
+    raise ValueError('Unknown cache serializer: %s' % name)
@@ -12,6 +12,47 @@ BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 CACHE_KEY_PREFIX = 'ghgdash-cache'
 CACHE_TYPE = 'simple'
 CACHE_REDIS_URL = None
+# The in-process cache tier in front of the shared cache
+CACHE_LOCAL_MAX_BYTES = int(os.getenv('CACHE_LOCAL_MAX_BYTES', 128 * 1024 * 1024))
+CACHE_LOCAL_DEFAULT_TIMEOUT = int(os.getenv('CACHE_LOCAL_DEFAULT_TIMEOUT', 300))
+# How values are stored in the shared cache: 'arrow' or 'pickle'
+CACHE_SERIALIZER = os.getenv('CACHE_SERIALIZER', 'arrow')
+CACHE_COMPRESSION = os.getenv('CACHE_COMPRESSION', 'snappy') or None
+# Check that each value stored as Arrow decodes back identically (slow, for debugging)
+CACHE_SERIALIZER_VERIFY = os.getenv('CACHE_SERIALIZER_VERIFY', '').lower() in ('1', 'true', 'yes')
+
+DATASET_STORE_DIR = os.getenv('DATASET_STORE_DIR', os.path.join(BASE_DIR, 'data', 'datasets'))
+DATASET_STORE_MMAP = os.getenv('DATASET_STORE_MMAP', '1').lower() in ('1', 'true', 'yes')
+# The prepared datasets computed from each version of the dataset store
+PREPARED_DATASET_DIR = os.getenv('PREPARED_DATASET_DIR', os.path.join(BASE_DIR, 'data', 'prepared'))
+
+# Load the datasets and compute the default scenario when a worker starts
+WARMUP = os.getenv('WARMUP', '').lower() in ('1', 'true', 'yes')
+WARMUP_THREADS = int(os.getenv('WARMUP_THREADS', 4))
+# Precompute the results for every value of the page sliders in the background
+PRECOMPUTE_SLIDERS = os.getenv('PRECOMPUTE_SLIDERS', '').lower() in ('1', 'true', 'yes')
+PRECOMPUTE_TIMEOUT = int(os.getenv('PRECOMPUTE_TIMEOUT', 24 * 3600))
+# Threads for computing the dependencies of a calcfunc in parallel (0 = serially)
+CALC_PARALLEL_WORKERS = int(os.getenv('CALC_PARALLEL_WORKERS', 0))
+# Seconds a worker may hold the lock for computing a calcfunc result and
+# seconds the other workers wait for the result before computing it themselves
+CALC_LOCK_TIMEOUT = int(os.getenv('CALC_LOCK_TIMEOUT', 120))
+CALC_LOCK_WAIT_TIMEOUT = int(os.getenv('CALC_LOCK_WAIT_TIMEOUT', 60))
+# Scenarios evaluated with one memo by calc.scenarios before starting a new one
+SCENARIO_MEMO_SIZE = int(os.getenv('SCENARIO_MEMO_SIZE', 50))
+# Print the calcfunc trace of each request
+PROFILE_CALC = os.getenv('PROFILE_CALC', '').lower() in ('1', 'true', 'yes')
+# Record the timings of each calcfunc call and keep the traces of the last
+# CALC_TRACE_HISTORY requests for the /_calc/traces debug endpoints
+CALC_TRACE = PROFILE_CALC or os.getenv('CALC_TRACE', '').lower() in ('1', 'true', 'yes')
+CALC_TRACE_HISTORY = int(os.getenv('CALC_TRACE_HISTORY', 50))
+# Return the calcfunc memo and cache hits of each request in the X-Calc-Stats header
+CALC_STATS_HEADER = os.getenv('CALC_STATS_HEADER', '').lower() in ('1', 'true', 'yes')
+# Cache the rendered page layouts per scenario for LAYOUT_CACHE_TIMEOUT seconds
+LAYOUT_CACHE = os.getenv('LAYOUT_CACHE', '1').lower() in ('1', 'true', 'yes')
+LAYOUT_CACHE_TIMEOUT = int(os.getenv('LAYOUT_CACHE_TIMEOUT', 3600))
+# Render the pages only when they are requested instead of all at startup
+LAZY_PAGES = os.getenv('LAZY_PAGES', '1').lower() in ('1', 'true', 'yes')
 
 SESSION_TYPE = 'filesystem'
 SESSION_FILE_DIR = os.path.join(BASE_DIR, 'flask_session')
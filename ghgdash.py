@@ -7,6 +7,7 @@ from flask_babel import Babel
 
 from layout import initialize_app
 from common import cache
+import calc.utils
 
 os.environ['DASH_PRUNE_ERRORS'] = 'False'
 os.environ['DASH_SILENCE_ROUTES_LOGGING'] = 'False'
@@ -20,6 +21,7 @@ with server.app_context():
     server.config.from_object('common.settings')
 
     cache.init_app(server)
+    calc.utils.init_app(server)
 
     sess = Session()
     sess.init_app(server)
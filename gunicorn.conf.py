@@ -0,0 +1,26 @@
+# Loaded automatically by gunicorn from the working directory.
+#
+# With WARMUP=1 the datasets and the default scenario are computed before
+# requests are served: once in the master when the app is preloaded
+# (--preload, the workers inherit the caches), otherwise in each worker.
+# With PRECOMPUTE_SLIDERS=1 each worker then precomputes the page slider
+# values in a background thread.
+from common import settings
+
+
+def when_ready(server):
+    if settings.WARMUP and server.cfg.preload_app:
+        from calc.warmup import warm_up
+        warm_up()
+
+
+def post_fork(server, worker):
+    if settings.WARMUP and not server.cfg.preload_app:
+        from calc.warmup import warm_up
+        warm_up()
+
+
+def post_worker_init(worker):
+    if settings.PRECOMPUTE_SLIDERS:
+        from calc.precompute import start_background_precompute
+        start_background_precompute()
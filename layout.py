@@ -1,5 +1,12 @@
+import glob
+import hashlib
+import json
+import os
+
 import flask
+import plotly
 from flask import request
+from flask_babel import get_locale
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
@@ -8,6 +15,9 @@ from dash.dependencies import Input, Output, State
 from utils.perf import PerfCounter
 from pages.routing import load_pages, all_pages, page_instance
 from pages.base import Page
+from common import cache, settings
+from calc.utils import get_code_hash
+from variables import get_scenario
 
 
 load_pages()
@@ -21,6 +31,7 @@ def page_callback_func(*inputs):
 
 
 _all_page_contents = []
+_layout_code_hash = None
 
 
 def generate_layout():
@@ -39,6 +50,27 @@ def generate_layout():
     ])
 
 
+def _get_layout_code_hash():
+    # The layouts change with the calculations and the page and component code
+    global _layout_code_hash
+
+    if _layout_code_hash is None:
+        m = hashlib.md5(get_code_hash().encode())
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        for pattern in ('pages/*.py', 'components/*.py'):
+            for path in sorted(glob.glob(os.path.join(base_dir, pattern))):
+                with open(path, 'rb') as f:
+                    m.update(f.read())
+        _layout_code_hash = m.hexdigest()
+    return _layout_code_hash
+
+
+def _get_layout_cache_key(path):
+    scenario = get_scenario()
+    scenario_key = scenario.hash if scenario.customized else 'default'
+    return 'layout:%s:%s:%s:%s' % (path, scenario_key, get_locale(), _get_layout_code_hash())
+
+
 def display_page(current_path, href):
     pc = PerfCounter('Page %s' % current_path)
     pc.display('start')
@@ -57,10 +89,27 @@ def display_page(current_path, href):
     else:
         return html.H2('Sisäinen virhe')
 
-    ret = [page.render(), dcc.Store(id=page.make_id('path-store'), data=page.path)]
+    # The navbar shows the number of custom settings in the session, so it
+    # is rendered for every request outside the cached layout.
+    navbar = page.make_navbar()
+
+    # The rest of the layout depends only on the page, the scenario and the
+    # locale, so it is cached as serialized JSON, which Dash returns to the
+    # browser as is.
+    cache_key = _get_layout_cache_key(current_path) if settings.LAYOUT_CACHE else None
+    if cache_key is not None:
+        data = cache.get(cache_key)
+        if data is not None:
+            pc.display('cache hit')
+            return [[navbar, *json.loads(data)]]
+
+    ret = [page.render(navbar=False), dcc.Store(id=page.make_id('path-store'), data=page.path)]
+    if cache_key is not None:
+        data = json.dumps(ret, cls=plotly.utils.PlotlyJSONEncoder)
+        cache.set(cache_key, data, timeout=settings.LAYOUT_CACHE_TIMEOUT)
 
     pc.display('finished')
-    return [ret]
+    return [[navbar, *ret]]
 
 
 def register_callbacks(app, pages):
@@ -85,6 +134,46 @@ def register_callbacks(app, pages):
             install_callback(callback)
 
 
+def _get_callback_ids(page):
+    """The (id, property) pairs of the inputs, outputs and state of the page callbacks"""
+    if hasattr(page, 'get_content'):
+        inputs, outputs = page.get_callback_info()
+        if not inputs:
+            return [], []
+        inputs = inputs + [State(page.make_id('path-store'), 'data')]
+    else:
+        inputs, outputs = [], []
+        for callback in page.callbacks:
+            inputs += callback.inputs + callback.state
+            outputs += callback.outputs
+    return (
+        [(x.component_id, x.component_property) for x in inputs],
+        [(x.component_id, x.component_property) for x in outputs],
+    )
+
+
+def validate_callback_ids(pages):
+    """Check the callbacks against the ids they declare, without rendering the pages
+
+    Each output may be updated by one callback only and, since only one
+    page is shown at a time, no page may use the ids of another page.
+    """
+    outputs = {}
+    id_pages = {}
+    for page in pages:
+        input_ids, output_ids = _get_callback_ids(page)
+        for output in output_ids:
+            if output in outputs:
+                raise Exception('Output %s.%s of page %s is already updated by page %s' % (
+                    *output, page.path, outputs[output].path
+                ))
+            outputs[output] = page
+        for comp_id, _ in input_ids + output_ids:
+            other = id_pages.setdefault(comp_id, page)
+            if other is not page:
+                raise Exception('Pages %s and %s both use the id %s' % (other.path, page.path, comp_id))
+
+
 def initialize_app(app):
     from utils.perf import PerfCounter
 
@@ -93,9 +182,7 @@ def initialize_app(app):
     page_contents = []
 
     pc = PerfCounter('pages')
-    pc.display('Rendering all')
 
-    # Generate all pages for checking input and output callbacks
     pages = []
     for page in all_pages.values():
         if isinstance(page, Page):
@@ -104,13 +191,25 @@ def initialize_app(app):
             page = page()
         else:
             raise Exception('Invalid page: %s' % page)
-
-        pc.display(page.path)
-
-        page_contents.append(page.render())
-        page_contents.append(dcc.Store(id=page.make_id('path-store')))
         pages.append(page)
 
+    if settings.LAZY_PAGES:
+        # The pages are rendered only when requested, so Dash cannot find
+        # the callback ids in the layout; check them against the ids the
+        # pages declare instead.
+        pc.display('Validating callbacks')
+        for page in pages:
+            page.make_cards()
+        validate_callback_ids(pages)
+        app.config.suppress_callback_exceptions = True
+    else:
+        # Generate all pages for checking input and output callbacks
+        pc.display('Rendering all')
+        for page in pages:
+            pc.display(page.path)
+            page_contents.append(page.render())
+            page_contents.append(dcc.Store(id=page.make_id('path-store')))
+
     pc.display('done')
 
     global _all_page_contents
@@ -12,13 +12,28 @@ from calc.emissions import SECTORS
 from variables import get_variable, set_variable
 
 
+def get_slider_values(slider, divisor=1):
+    """The variable values of every position of a slider dict(min=..., max=..., step=...)
+
+    divisor is what the callback divides the slider value by to get the
+    variable value.
+    """
+    values = range(slider['min'], slider['max'] + 1, slider['step'])
+    if divisor == 1:
+        return list(values)
+    return [x / divisor for x in values]
+
+
 class Page:
     id: str
     name: str
     path: str
     emission_sector: tuple = None
+    # Calcfuncs to precompute for every value of the slider-bound variables:
+    # dict(funcs=[calcfunc, ...], variables={var_name: [value, ...]})
+    precompute: dict = None
 
-    def __init__(self, id=None, name=None, content=None, path=None, emission_sector=None):
+    def __init__(self, id=None, name=None, content=None, path=None, emission_sector=None, precompute=None):
         if id:
             self.id = id
         if name:
@@ -30,6 +45,8 @@ class Page:
         if emission_sector:
             assert isinstance(emission_sector, (tuple, list, str))
             self.emission_sector = emission_sector
+        if precompute:
+            self.precompute = precompute
         if self.emission_sector and isinstance(self.emission_sector, str):
             self.emission_sector = (self.emission_sector,)
         if self.emission_sector:
@@ -104,7 +121,7 @@ class Page:
         from components.emission_nav import make_emission_nav
         return make_emission_nav(self)
 
-    def _make_navbar(self):
+    def make_navbar(self):
         if flask.has_request_context():
             custom_setting_count = len([k for k in session.keys() if not k.startswith('_')])
         else:
@@ -148,7 +165,7 @@ class Page:
         bar = StickyBar(current_page=self, **self.get_summary_vars())
         return bar.render()
 
-    def _make_page_contents(self):
+    def _make_page_contents(self, navbar=True):
         if hasattr(self, 'get_content'):
             # Class-based (new-style) page
             content = self.get_content()
@@ -170,7 +187,7 @@ class Page:
 
         ret = html.Div([
             # represents the URL bar, doesn't render anything
-            self._make_navbar(),
+            self.make_navbar() if navbar else None,
             dbc.Container(
                 dbc.Row([
                     dbc.Col(id=self.make_id('left-nav'), md=2, children=self._make_emission_nav()),
@@ -186,9 +203,9 @@ class Page:
     def make_cards(self):
         pass
 
-    def render(self):
+    def render(self, navbar=True):
         self.make_cards()
-        return html.Div(self._make_page_contents(), id=self.make_id('page-content'))
+        return html.Div(self._make_page_contents(navbar), id=self.make_id('page-content'))
 
     def add_graph_card(self, id, **kwargs):
         card_id = self.make_id(id)
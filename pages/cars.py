@@ -7,13 +7,16 @@ from components.stickybar import StickyBar
 from components.graphs import PredictionFigure
 from components.card_description import CardDescription
 from components.cards import GraphCard, ConnectedCardGrid
-from .base import Page
+from .base import Page, get_slider_values
 
 from calc.cars import predict_cars_emissions
 from utils.colors import GHG_MAIN_SECTOR_COLORS
 
 CARS_GOAL = 119  # kt CO2e
 
+BEV_PERCENTAGE_SLIDER = dict(min=0, max=100, step=5)
+MILEAGE_PER_RESIDENT_SLIDER = dict(min=-60, max=20, step=5)
+
 
 ENGINE_TYPES = {
     'electric': dict(name='Sähkömoottori', color=GHG_MAIN_SECTOR_COLORS['ElectricityConsumption']),
@@ -62,9 +65,7 @@ def generate_page():
     bev_perc_card = GraphCard(
         id='cars-bev-percentage',
         slider=dict(
-            min=0,
-            max=100,
-            step=5,
+            BEV_PERCENTAGE_SLIDER,
             value=get_variable('cars_bev_percentage'),
             marks={x: '%d %%' % x for x in range(0, 100 + 1, 10)},
         ),
@@ -72,9 +73,7 @@ def generate_page():
     per_resident_card = GraphCard(
         id='cars-mileage-per-resident',
         slider=dict(
-            min=-60,
-            max=20,
-            step=5,
+            MILEAGE_PER_RESIDENT_SLIDER,
             value=get_variable('cars_mileage_per_resident_adjustment'),
             marks={x: '%d %%' % (x) for x in range(-60, 20 + 1, 10)},
         ),
@@ -121,7 +120,14 @@ page = Page(
     name='Henkilöautoilun päästöt',
     content=generate_page,
     path='/autot',
-    emission_sector=('Transportation', 'Cars')
+    emission_sector=('Transportation', 'Cars'),
+    precompute=dict(
+        funcs=[predict_cars_emissions],
+        variables=dict(
+            cars_bev_percentage=get_slider_values(BEV_PERCENTAGE_SLIDER),
+            cars_mileage_per_resident_adjustment=get_slider_values(MILEAGE_PER_RESIDENT_SLIDER),
+        ),
+    ),
 )
 
 
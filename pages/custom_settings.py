@@ -7,6 +7,7 @@ from dash.dependencies import Input, Output
 import dash_bootstrap_components as dbc
 import dash_html_components as html
 
+from variables import reset_variables
 from .base import Page
 
 
@@ -37,5 +38,5 @@ page = Page(id='custom-settings', name='Omat asetukset', content=custom_settings
     inputs=[Input('custom-settings-clear-button', 'n_clicks')]
 )
 def custom_settings_clear(n_clicks):
-    session.clear()
+    reset_variables()
     return [generate_custom_settings_list()]
@@ -140,6 +140,7 @@ class ProductionMethod:
         ratios = get_variable('district_heating_target_production_ratios')
         assert key in ratios
         ratios[key] = val
+        set_variable('district_heating_target_production_ratios', ratios)
 
     def get_ratio_input(self):
         return Input(self.make_id('ratio-slider'), 'value')
@@ -9,7 +9,11 @@ from components.graphs import PredictionFigure
 from components.card_description import CardDescription
 from components.stickybar import StickyBar
 
-from .base import Page
+from .base import Page, get_slider_values
+
+
+# The slider is in tenths of a percent
+PER_CAPITA_SLIDER = dict(min=-50, max=20, step=5)
 
 
 def render_page():
@@ -18,9 +22,7 @@ def render_page():
     per_capita_card = GraphCard(
         id='electricity-consumption-per-capita',
         slider=dict(
-            min=-50,
-            max=20,
-            step=5,
+            PER_CAPITA_SLIDER,
             value=int(get_variable('electricity_consumption_per_capita_adjustment') * 10),
             marks={x: '%d %%' % (x / 10) for x in range(-50, 20 + 1, 10)},
         )
@@ -54,7 +56,13 @@ def render_page():
 
 page = Page(
     id='electricity-consumption', name='Kulutussähkö', content=render_page, path='/kulutussahko',
-    emission_sector='ElectricityConsumption'
+    emission_sector='ElectricityConsumption',
+    precompute=dict(
+        funcs=[predict_electricity_consumption_emissions],
+        variables=dict(
+            electricity_consumption_per_capita_adjustment=get_slider_values(PER_CAPITA_SLIDER, divisor=10),
+        ),
+    ),
 )
 
 
@@ -1,4 +1,6 @@
 import os
+from functools import lru_cache
+
 import pandas as pd
 import dash_table
 import dash_core_components as dcc
@@ -19,11 +21,16 @@ PRICE_PER_PEAK_KW = 1000
 PEAK_WATTS_PER_M2 = 150
 
 
-hel_buildings, hsy_buildings, fingrid_price = load_datasets([
-    'jyrjola/karttahel/buildings', 'jyrjola/hsy/buildings', 'jyrjola/fingrid_hourly/price'
-])
+# The datasets are loaded on first use instead of when the module is imported
+
+@lru_cache()
+def get_source_datasets():
+    return load_datasets([
+        'jyrjola/karttahel/buildings', 'jyrjola/hsy/buildings', 'jyrjola/fingrid_hourly/price'
+    ])
 
 
+@lru_cache()
 def read_nuuka_data():
     DATA_DIR = 'data/nuuka'
 
@@ -42,12 +49,12 @@ def read_nuuka_data():
     return buildings, sensors
 
 
-buildings, sensors = read_nuuka_data()
-electricity_sensors = sensors.query('category == "electricity"')
-heating_sensors = sensors.query('category == "heating"')
+def get_sensors(category):
+    _, sensors = read_nuuka_data()
+    return sensors.query('category == "%s"' % category)
 
 
-def combine_buildings():
+def combine_buildings(buildings, hel_buildings):
     buildings['VTJPRT'] = None
     hel_buildings['BuildingID'] = None
 
@@ -92,7 +99,11 @@ def combine_buildings():
 
 @calcfunc()
 def get_buildings_with_pv():
-    combine_buildings()
+    hel_buildings, hsy_buildings, _ = get_source_datasets()
+    buildings, _ = read_nuuka_data()
+    buildings = buildings.copy()
+    hel_buildings = hel_buildings.copy()
+    combine_buildings(buildings, hel_buildings)
 
     bdf = hel_buildings.dropna(subset=['BuildingID', 'VTJPRT'])
     hsydf = hsy_buildings.set_index('vtj_prt')[['panel_ala', 'elec_kwh_v']].dropna()
@@ -123,112 +134,117 @@ def calculate_percentage_of_yearly_radiation(datasets):
     return perc_sol
 
 
-try:
-    buildings_with_pv = pd.read_parquet('data/nuuka/buildings_with_pv.parquet')
-except Exception:
-    buildings_with_pv = get_buildings_with_pv()
-    buildings_with_pv.to_parquet('data/nuuka/buildings_with_pv.parquet')
-
-
-page_content = dbc.Row([dbc.Col([
-    dbc.Row([
-        dbc.Col([
-            html.H5('Rakennus'),
-            dcc.Dropdown(
-                id='building-selector-dropdown',
-                options=[dict(label=b.description, value=b_id) for b_id, b in buildings_with_pv.iterrows()],
-                value=buildings_with_pv.index[0]
-            )
-        ], className='mb-4'),
-    ]),
-    dbc.Row([
-        dbc.Col([
-            dcc.Loading(id="loading-3", children=[
-                html.Div(id="building-info-placeholder")
-            ], type="default"),
+@lru_cache()
+def load_buildings_with_pv():
+    try:
+        return pd.read_parquet('data/nuuka/buildings_with_pv.parquet')
+    except Exception:
+        buildings_with_pv = get_buildings_with_pv()
+        buildings_with_pv.to_parquet('data/nuuka/buildings_with_pv.parquet')
+        return buildings_with_pv
+
+
+def page_content():
+    buildings_with_pv = load_buildings_with_pv()
+    return dbc.Row([dbc.Col([
+        dbc.Row([
+            dbc.Col([
+                html.H5('Rakennus'),
+                dcc.Dropdown(
+                    id='building-selector-dropdown',
+                    options=[dict(label=b.description, value=b_id) for b_id, b in buildings_with_pv.iterrows()],
+                    value=buildings_with_pv.index[0]
+                )
+            ], className='mb-4'),
         ]),
-    ]),
-    html.H4('Aurinkopaneelit'),
-    dbc.Row([
-        dbc.Col([
-            dbc.FormGroup([
-                dbc.Label('Alkukustannus', html_for='price-of-initial-installation'),
-                dbc.InputGroup([
-                    dbc.Input(
-                        type='number',
-                        id='price-of-initial-installation',
-                        value=INITIAL_INSTALL_PRICE,
-                    ),
-                    dbc.InputGroupAddon("€", addon_type="append"),
-                ]),
+        dbc.Row([
+            dbc.Col([
+                dcc.Loading(id="loading-3", children=[
+                    html.Div(id="building-info-placeholder")
+                ], type="default"),
             ]),
-        ], md=3),
-        dbc.Col([
-            dbc.FormGroup([
-                dbc.Label('Piikkitehon marginaalikustannus', html_for='marginal-price-of-peak-power'),
-                dbc.InputGroup([
-                    dbc.Input(
-                        type='number',
-                        id='marginal-price-of-peak-power',
-                        value=PRICE_PER_PEAK_KW,
-                    ),
-                    dbc.InputGroupAddon("€/kWp", addon_type="append"),
+        ]),
+        html.H4('Aurinkopaneelit'),
+        dbc.Row([
+            dbc.Col([
+                dbc.FormGroup([
+                    dbc.Label('Alkukustannus', html_for='price-of-initial-installation'),
+                    dbc.InputGroup([
+                        dbc.Input(
+                            type='number',
+                            id='price-of-initial-installation',
+                            value=INITIAL_INSTALL_PRICE,
+                        ),
+                        dbc.InputGroupAddon("€", addon_type="append"),
+                    ]),
                 ]),
-            ]),
-        ], md=5),
-        dbc.Col([
-            dbc.FormGroup([
-                dbc.Label('Laitteiston pitoaika', html_for='investment-years'),
-                dbc.InputGroup([
-                    dbc.Input(
-                        type='number',
-                        id='investment-years',
-                        value=20,
-                    ),
-                    dbc.InputGroupAddon("vuotta", addon_type="append"),
+            ], md=3),
+            dbc.Col([
+                dbc.FormGroup([
+                    dbc.Label('Piikkitehon marginaalikustannus', html_for='marginal-price-of-peak-power'),
+                    dbc.InputGroup([
+                        dbc.Input(
+                            type='number',
+                            id='marginal-price-of-peak-power',
+                            value=PRICE_PER_PEAK_KW,
+                        ),
+                        dbc.InputGroupAddon("€/kWp", addon_type="append"),
+                    ]),
                 ]),
-            ]),
-        ], md=4)
-    ]),
-    dbc.Row([
-        dbc.Col([
-            dbc.FormGroup([
-                dbc.Label('Ostosähkön hinta', html_for='price-of-purchased-electricity'),
-                dbc.InputGroup([
-                    dbc.Input(
-                        type='number',
-                        id='price-of-purchased-electricity',
-                        value=DEFAULT_PRICE_PER_KWH,
-                        inputMode='numeric',
-                    ),
-                    dbc.InputGroupAddon("c/kWh", addon_type="append"),
+            ], md=5),
+            dbc.Col([
+                dbc.FormGroup([
+                    dbc.Label('Laitteiston pitoaika', html_for='investment-years'),
+                    dbc.InputGroup([
+                        dbc.Input(
+                            type='number',
+                            id='investment-years',
+                            value=20,
+                        ),
+                        dbc.InputGroupAddon("vuotta", addon_type="append"),
+                    ]),
                 ]),
-            ]),
-        ], md=3),
-        dbc.Col([
-            dbc.FormGroup([
-                dbc.Label('Ylijäämäsähkön myynti', html_for='grid-output-percentage'),
-                dbc.InputGroup([
-                    dbc.Input(
-                        type='number',
-                        id='grid-output-percentage',
-                        value=90,
-                        inputMode='numeric',
-                    ),
-                    dbc.InputGroupAddon("%", addon_type="append"),
+            ], md=4)
+        ]),
+        dbc.Row([
+            dbc.Col([
+                dbc.FormGroup([
+                    dbc.Label('Ostosähkön hinta', html_for='price-of-purchased-electricity'),
+                    dbc.InputGroup([
+                        dbc.Input(
+                            type='number',
+                            id='price-of-purchased-electricity',
+                            value=DEFAULT_PRICE_PER_KWH,
+                            inputMode='numeric',
+                        ),
+                        dbc.InputGroupAddon("c/kWh", addon_type="append"),
+                    ]),
                 ]),
-            ]),
-        ], md=4),
-    ]),
-    dbc.Row([
-        dbc.Col([
-            dbc.Button("Laske", id="calculate-button", className="float-right"),
-        ])
-    ]),
-    dcc.Loading(id="loading-1", children=[
-        html.Div(id="building-placeholder")
-    ], type="default"),
-], md=8)])
+            ], md=3),
+            dbc.Col([
+                dbc.FormGroup([
+                    dbc.Label('Ylijäämäsähkön myynti', html_for='grid-output-percentage'),
+                    dbc.InputGroup([
+                        dbc.Input(
+                            type='number',
+                            id='grid-output-percentage',
+                            value=90,
+                            inputMode='numeric',
+                        ),
+                        dbc.InputGroupAddon("%", addon_type="append"),
+                    ]),
+                ]),
+            ], md=4),
+        ]),
+        dbc.Row([
+            dbc.Col([
+                dbc.Button("Laske", id="calculate-button", className="float-right"),
+            ])
+        ]),
+        dcc.Loading(id="loading-1", children=[
+            html.Div(id="building-placeholder")
+        ], type="default"),
+    ], md=8)])
 
 
 def simulate_pv_production(percentage_power, df, variables, datasets):
@@ -410,17 +426,17 @@ def building_base_info_callback(selected_building_id):
             ]),
         ])
 
-    building = buildings_with_pv.loc[selected_building_id]
+    building = load_buildings_with_pv().loc[selected_building_id]
 
     samples = pd.read_parquet('data/nuuka/%s.parquet' % selected_building_id)
     samples = samples.query('time < "2019-01-01T00:00:00Z"')
 
-    el_samples = samples[samples.sensor_id.isin(electricity_sensors.index)]
+    el_samples = samples[samples.sensor_id.isin(get_sensors('electricity').index)]
     el_samples = el_samples.groupby(['building_id', 'time']).value.sum().reset_index()
     el_samples = el_samples.set_index('time')
     el_samples['emissions'] = el_samples['value'].mul(datasets['electricity_supply_emission_factor'], axis=0, fill_value=0) / 1000
 
-    dh_samples = samples[samples.sensor_id.isin(heating_sensors.index)].query('value < 30000')
+    dh_samples = samples[samples.sensor_id.isin(get_sensors('heating').index)].query('value < 30000')
     dh_samples = dh_samples.groupby(['building_id', 'time']).value.sum().reset_index()
     dh_samples = dh_samples.set_index('time')
     dh_samples['emissions'] = dh_samples['value'] * 200 / 1000
@@ -499,7 +515,7 @@ def building_selector_callback(
     datasets = dict(
         yearly_solar_radiation_ratio=calculate_percentage_of_yearly_radiation(),
         electricity_supply_emission_factor=calculate_electricity_supply_emission_factor()['EmissionFactor'],
-        electricity_spot_price=fingrid_price.purchase_price_of_production_imbalance_power,
+        electricity_spot_price=get_source_datasets()[2].purchase_price_of_production_imbalance_power,
     )
 
     variables = dict(
@@ -523,10 +539,10 @@ def building_selector_callback(
             ]),
         ])
 
-    building = buildings_with_pv.loc[selected_building_id]
+    building = load_buildings_with_pv().loc[selected_building_id]
 
     df = pd.read_parquet('data/nuuka/%s.parquet' % selected_building_id)
-    el_samples = df[df.sensor_id.isin(electricity_sensors.index)]
+    el_samples = df[df.sensor_id.isin(get_sensors('electricity').index)]
     el_samples = el_samples.groupby(['building_id', 'time']).value.sum().reset_index()
 
     sim = analyze_building(building, el_samples, None, variables, datasets)
@@ -604,7 +620,7 @@ def pv_summary_graph_click(
     datasets = dict(
         yearly_solar_radiation_ratio=calculate_percentage_of_yearly_radiation(),
         electricity_supply_emission_factor=calculate_electricity_supply_emission_factor()['EmissionFactor'],
-        electricity_spot_price=fingrid_price.purchase_price_of_production_imbalance_power,
+        electricity_spot_price=get_source_datasets()[2].purchase_price_of_production_imbalance_power,
     )
 
     variables = dict(
@@ -615,10 +631,10 @@ def pv_summary_graph_click(
         investment_years=investment_years,
     )
 
-    building = buildings_with_pv.loc[selected_building_id]
+    building = load_buildings_with_pv().loc[selected_building_id]
 
     df = pd.read_parquet('data/nuuka/%s.parquet' % selected_building_id)
-    el_samples = df[df.sensor_id.isin(electricity_sensors.index)]
+    el_samples = df[df.sensor_id.isin(get_sensors('electricity').index)]
     el_samples = el_samples.groupby(['building_id', 'time']).value.sum().reset_index()
 
     res = analyze_building(building, el_samples, perc, variables, datasets)
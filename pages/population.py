@@ -10,7 +10,10 @@ from components.cards import GraphCard
 from components.graphs import make_layout
 from components.card_description import CardDescription
 from components.stickybar import StickyBar
-from .base import Page
+from .base import Page, get_slider_values
+
+
+POPULATION_CORRECTION_SLIDER = dict(min=-20, max=20, step=5)
 
 
 def generate_population_forecast_graph(pop_df):
@@ -54,9 +57,7 @@ def generate_population_forecast_graph(pop_df):
 
 def render_page():
     slider = dict(
-        min=-20,
-        max=20,
-        step=5,
+        POPULATION_CORRECTION_SLIDER,
         value=get_variable('population_forecast_correction'),
         marks={x: '%d %%' % x for x in range(-20, 20 + 1, 5)},
     )
@@ -71,7 +72,11 @@ page = Page(
     id='population',
     name='Väestö',
     content=render_page,
-    path='/vaesto'
+    path='/vaesto',
+    precompute=dict(
+        funcs=[get_adjusted_population_forecast],
+        variables=dict(population_forecast_correction=get_slider_values(POPULATION_CORRECTION_SLIDER)),
+    ),
 )
 
 
@@ -20,3 +20,13 @@ def deepupdate(target, src):
                 target[k].update(v.copy())
         else:
             target[k] = copy.copy(v)
+
+
+def copy_value(val):
+    # DataFrames handed out from shared storage are copied so that
+    # callers may modify them freely.
+    if isinstance(val, tuple):
+        return tuple(copy_value(x) for x in val)
+    if hasattr(val, 'copy'):
+        return val.copy()
+    return val
@@ -37,3 +37,66 @@ def get_contributions_from_multipliers(df, a_column, ef_column):
     df[ef_column] = ef_part
 
     return df
+
+
+FILTER_OPS = ('==', '!=', '<', '<=', '>', '>=', 'in', 'not in')
+
+
+def filter_dataframe(df, filters):
+    """Keep the rows matching all the (column, op, value) filters"""
+    mask = None
+    for col, op, val in filters:
+        s = df[col]
+        if op == '==':
+            m = s == val
+        elif op == '!=':
+            m = s != val
+        elif op == '<':
+            m = s < val
+        elif op == '<=':
+            m = s <= val
+        elif op == '>':
+            m = s > val
+        elif op == '>=':
+            m = s >= val
+        elif op == 'in':
+            m = s.isin(val)
+        elif op == 'not in':
+            m = ~s.isin(val)
+        else:
+            raise ValueError('Unknown filter operator: %s' % op)
+        mask = m if mask is None else mask & m
+    if mask is None:
+        return df
+    return df[mask]
+
+
+def select_dataset_rows(df, columns=None, filters=None):
+    """Apply the column projection and row filters of a dataset declaration"""
+    if filters:
+        df = filter_dataframe(df, filters)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+
+def split_dataset_rows(df, partition_columns, columns=None):
+    """Split the rows by the values of partition_columns, return ({key: DataFrame}, empty DataFrame)
+
+    The keys are values with a single partition column and tuples otherwise.
+    """
+    projection = list(columns) if columns is not None else slice(None)
+    keys = partition_columns[0] if len(partition_columns) == 1 else list(partition_columns)
+    partitions = {key: group.loc[:, projection] for key, group in df.groupby(keys, sort=False, observed=True)}
+    return partitions, df.iloc[0:0].loc[:, projection]
+
+
+def get_read_columns(columns, filters):
+    """Columns that have to be read to apply both the projection and the filters"""
+    if columns is None:
+        return None
+    read_columns = list(columns)
+    for col, _, _ in filters or []:
+        if col not in read_columns:
+            read_columns.append(col)
+    return read_columns
@@ -0,0 +1,408 @@
+"""Local, versioned store of the datasets used by the calcfuncs.
+
+The store is a directory with one subdirectory per materialized version
+and a CURRENT file naming the version in use:
+
+    <DATASET_STORE_DIR>/CURRENT
+    <DATASET_STORE_DIR>/<version>/manifest.json
+    <DATASET_STORE_DIR>/<version>/<dataset files>
+
+Materialize the datasets declared by the calcfuncs with:
+
+    python -m utils.dataset_store materialize
+
+Datasets stored as Arrow IPC files (--format arrow or --arrow DATASET)
+are memory-mapped when loaded, so that all worker processes share the
+same pages of the file. The rows each calcfunc selects from an Arrow
+dataset with its filters are also stored in a file of their own, stably
+sorted by the columns partitioned by a variable (e.g. the municipality),
+so that the rows and partitions handed to the calcfuncs are slices of the
+mapped files instead of copies.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import fastparquet
+
+from utils.data import select_dataset_rows, split_dataset_rows, get_read_columns
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+CURRENT_FILE = 'CURRENT'
+FORMATS = ('parquet', 'arrow')
+
+
+def _dataset_file_name(package_path, format, suffix=''):
+    return '%s%s.%s' % (package_path.replace('/', '__'), suffix, format)
+
+
+def _write_arrow(path, df, preserve_index=None):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=preserve_index)
+    with pa.OSFile(path, 'wb') as sink:
+        writer = pa.RecordBatchFileWriter(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+
+
+def _get_index_columns(table):
+    metadata = table.schema.metadata or {}
+    if b'pandas' not in metadata:
+        return []
+    index_columns = json.loads(metadata[b'pandas'].decode())['index_columns']
+    return [x for x in index_columns if isinstance(x, str)]
+
+
+def _select_arrow_columns(table, columns):
+    # Table.select is not available in older pyarrow versions. The index
+    # columns in the pandas metadata are kept for to_pandas.
+    import pyarrow as pa
+
+    names = list(columns)
+    names += [x for x in _get_index_columns(table) if x not in names]
+    arrays = [table.column(table.schema.get_field_index(name)) for name in names]
+    return pa.Table.from_arrays(arrays, names=names, metadata=table.schema.metadata)
+
+
+def _read_arrow_table(path, memory_map, columns=None):
+    import pyarrow as pa
+
+    if memory_map:
+        # The pages of a memory-mapped file are shared through the page
+        # cache by all processes mapping it.
+        source = pa.memory_map(path, 'r')
+    else:
+        source = pa.OSFile(path, 'rb')
+    table = pa.RecordBatchFileReader(source).read_all()
+    if columns is not None:
+        table = _select_arrow_columns(table, columns)
+    return table
+
+
+def _is_zero_copy_column(column):
+    import pyarrow as pa
+
+    if column.num_chunks != 1 or column.null_count:
+        return False
+    return pa.types.is_integer(column.type) or pa.types.is_floating(column.type)
+
+
+def _keep_blocks(df):
+    # Operations on the DataFrame would otherwise consolidate its blocks
+    # in place, copying the mapped columns to the memory of the process.
+    mgr = getattr(df, '_mgr', None) or df._data
+    if hasattr(mgr, '_known_consolidated'):
+        mgr._known_consolidated = True
+        mgr._is_consolidated = True
+    return df
+
+
+def _arrow_to_pandas(table):
+    try:
+        # Keep each column in its own block so that numeric columns
+        # without nulls can point directly to the mapped memory.
+        return _keep_blocks(table.to_pandas(split_blocks=True))
+    except TypeError:
+        pass
+
+    # Older pyarrow versions copy the columns into consolidated blocks,
+    # so the numeric columns without nulls are converted separately.
+    from pandas.core.internals import BlockManager, make_block
+
+    index_columns = _get_index_columns(table)
+    names = [name for name in table.schema.names if name not in index_columns]
+    direct = set(name for name in names if _is_zero_copy_column(table.column(table.schema.get_field_index(name))))
+    rest = [name for name in names if name not in direct]
+    if not direct or not rest:
+        return table.to_pandas()
+    df = _select_arrow_columns(table, rest).to_pandas()
+    if list(df.columns) != rest:
+        return table.to_pandas()
+
+    positions = [names.index(name) for name in rest]
+    blocks = [
+        block.make_block_same_class(block.values, placement=[positions[i] for i in block.mgr_locs.as_array])
+        for block in df._data.blocks
+    ]
+    for name in direct:
+        values = table.column(table.schema.get_field_index(name)).chunk(0).to_numpy()
+        blocks.append(make_block(values.reshape(1, -1), placement=[names.index(name)], ndim=2))
+    return _keep_blocks(pd.DataFrame(BlockManager(blocks, [pd.Index(names, name=df.columns.name), df.index])))
+
+
+def _table_to_pandas(table, columns, filters):
+    if filters:
+        return select_dataset_rows(_arrow_to_pandas(table), columns, filters)
+    # Project before converting, so that the columns are not copied
+    if columns is not None:
+        table = _select_arrow_columns(table, columns)
+    return _arrow_to_pandas(table)
+
+
+def _find_partition_runs(table, partition_columns):
+    """(key, start, stop) of each run of equal partition keys in a table sorted by them"""
+    keys = pd.DataFrame({
+        col: pd.Series(np.asarray(table.column(table.schema.get_field_index(col)).to_pandas()))
+        for col in partition_columns
+    }, columns=partition_columns)
+    if not len(keys):
+        return []
+    starts = np.flatnonzero((keys != keys.shift()).any(axis=1).values)
+    stops = np.append(starts[1:], len(keys))
+    run_keys = keys.iloc[starts]
+    # Rows with null keys do not match any filter
+    valid = run_keys.notnull().all(axis=1).values
+    run_keys, starts, stops = run_keys[valid], starts[valid], stops[valid]
+    if len(partition_columns) == 1:
+        key_values = list(run_keys.iloc[:, 0])
+    else:
+        key_values = list(run_keys.itertuples(index=False, name=None))
+    return [(key, int(start), int(stop)) for key, start, stop in zip(key_values, starts, stops)]
+
+
+def _selection_key(filters, partition_columns):
+    return json.dumps([[list(f) for f in filters], list(partition_columns)], ensure_ascii=False)
+
+
+def _file_sha1(path):
+    m = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            m.update(chunk)
+    return m.hexdigest()
+
+
+class DatasetStore:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.version = None
+        self.manifest = None
+
+        current_path = os.path.join(root_dir, CURRENT_FILE)
+        if not os.path.exists(current_path):
+            return
+        with open(current_path, 'r') as f:
+            version = f.read().strip()
+        with open(os.path.join(root_dir, version, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+        self.version = version
+
+    def has_dataset(self, package_path):
+        return self.manifest is not None and package_path in self.manifest['datasets']
+
+    def get_dataset_info(self, package_path):
+        return self.manifest['datasets'][package_path]
+
+    def get_dataset_path(self, package_path):
+        info = self.get_dataset_info(package_path)
+        return os.path.join(self.root_dir, self.version, info['file'])
+
+    def is_arrow(self, package_path):
+        return self.get_dataset_info(package_path).get('format', 'parquet') == 'arrow'
+
+    def _get_selection_path(self, package_path, filters, partition_columns):
+        selections = self.get_dataset_info(package_path).get('selections', {})
+        selection = selections.get(_selection_key(filters, partition_columns))
+        if selection is None:
+            return None
+        return os.path.join(self.root_dir, self.version, selection['file'])
+
+    def load(self, package_path, memory_map=True, columns=None, filters=None):
+        path = self.get_dataset_path(package_path)
+        read_columns = get_read_columns(columns, filters)
+        if self.is_arrow(package_path):
+            selection_path = self._get_selection_path(package_path, filters or [], [])
+            if selection_path is not None:
+                return _arrow_to_pandas(_read_arrow_table(selection_path, memory_map, columns))
+            table = _read_arrow_table(path, memory_map, read_columns)
+            return _table_to_pandas(table, columns, filters)
+
+        # Row groups whose statistics do not match the filters are skipped
+        pf = fastparquet.ParquetFile(path)
+        df = pf.to_pandas(columns=read_columns, filters=filters or [])
+        return select_dataset_rows(df, columns, filters)
+
+    def load_partitions(self, package_path, partition_columns, memory_map=True, columns=None, filters=None):
+        """Load the rows matching filters split by the values of partition_columns
+
+        Returns ({key: DataFrame}, empty DataFrame) as split_dataset_rows.
+        If the selection was materialized, the partitions are slices of
+        its mapped file.
+        """
+        filters = list(filters or [])
+        with_partitions = None
+        if columns is not None:
+            with_partitions = list(columns) + [col for col in partition_columns if col not in columns]
+        selection_path = None
+        if self.is_arrow(package_path):
+            selection_path = self._get_selection_path(package_path, filters, partition_columns)
+        if selection_path is None:
+            df = self.load(package_path, memory_map, with_partitions, filters)
+            return split_dataset_rows(df, partition_columns, columns)
+
+        table = _read_arrow_table(selection_path, memory_map, with_partitions)
+        if columns is not None:
+            columns = list(columns)
+        partitions = {}
+        for key, start, stop in _find_partition_runs(table, partition_columns):
+            partitions[key] = _table_to_pandas(table.slice(start, stop - start), columns, None)
+        return partitions, _table_to_pandas(table.slice(0, 0), columns, None)
+
+    def materialize(self, datasets, format='parquet', arrow_datasets=None, selections=None):
+        """Write the given {package_path: DataFrame} as a new version and make it current
+
+        Datasets are written in `format`, except for the ones listed in
+        `arrow_datasets` which are written as Arrow IPC files. For Arrow
+        datasets the rows matching each of their selections
+        ({package_path: [(filters, partition_columns), ...]}) are also
+        written to a file of their own, stably sorted by the partition
+        columns.
+        """
+        assert format in FORMATS
+        arrow_datasets = set(arrow_datasets or [])
+        selections = selections or {}
+
+        version = time.strftime('%Y%m%d-%H%M%S')
+        version_dir = os.path.join(self.root_dir, version)
+        os.makedirs(version_dir)
+
+        manifest = dict(version=version, created_at=time.time(), datasets={})
+        for package_path, df in sorted(datasets.items()):
+            ds_format = 'arrow' if package_path in arrow_datasets else format
+            file_name = _dataset_file_name(package_path, ds_format)
+            path = os.path.join(version_dir, file_name)
+            info = dict(file=file_name, format=ds_format, rows=len(df), columns=[str(x) for x in df.columns])
+            if ds_format == 'arrow':
+                _write_arrow(path, df)
+                info['selections'] = {}
+                for filters, partition_columns in selections.get(package_path, []):
+                    key = _selection_key(filters, partition_columns)
+                    sel_df = select_dataset_rows(df, None, filters)
+                    if partition_columns:
+                        sel_df = sel_df.sort_values(list(partition_columns), kind='mergesort', na_position='last')
+                    sel_file = _dataset_file_name(
+                        package_path, ds_format, '.%s' % hashlib.sha1(key.encode()).hexdigest()[:12]
+                    )
+                    # The index is stored as a column so that it survives slicing
+                    _write_arrow(os.path.join(version_dir, sel_file), sel_df, preserve_index=True)
+                    info['selections'][key] = dict(file=sel_file, rows=len(sel_df))
+            else:
+                fastparquet.write(path, df, compression='SNAPPY')
+            info['sha1'] = _file_sha1(path)
+            manifest['datasets'][package_path] = info
+
+        with open(os.path.join(version_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+        # Switch to the new version atomically
+        tmp_path = os.path.join(self.root_dir, CURRENT_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(version + '\n')
+        os.replace(tmp_path, os.path.join(self.root_dir, CURRENT_FILE))
+
+        self.version = version
+        self.manifest = manifest
+        return version
+
+
+_store = None
+
+
+def get_store():
+    global _store
+
+    if _store is None:
+        from common import settings
+        _store = DatasetStore(settings.DATASET_STORE_DIR)
+    return _store
+
+
+def load_dataset(package_path, columns=None, filters=None):
+    from common import settings
+
+    store = get_store()
+    if store.has_dataset(package_path):
+        return store.load(
+            package_path, memory_map=settings.DATASET_STORE_MMAP, columns=columns, filters=filters
+        )
+
+    # Fall back to the quilt package store
+    from utils.quilt import load_datasets
+
+    logger.warning('Dataset %s not found in the local store, loading from quilt' % package_path)
+    return load_datasets(package_path, columns=columns, filters=filters)
+
+
+def load_dataset_partitions(package_path, partition_columns, columns=None, filters=None):
+    """Load the dataset split by the values of partition_columns, see DatasetStore.load_partitions"""
+    from common import settings
+
+    store = get_store()
+    if store.has_dataset(package_path):
+        return store.load_partitions(
+            package_path, partition_columns, memory_map=settings.DATASET_STORE_MMAP, columns=columns,
+            filters=filters,
+        )
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns) + [col for col in partition_columns if col not in columns]
+    df = load_dataset(package_path, columns=read_columns, filters=filters)
+    return split_dataset_rows(df, partition_columns, columns)
+
+
+def materialize(root_dir, format='parquet', arrow_datasets=None):
+    from utils.quilt import load_datasets
+    from calc.utils import get_declared_datasets, get_dataset_selections
+
+    datasets = {}
+    for package_path in sorted(get_declared_datasets()):
+        print('Loading %s' % package_path)
+        df = load_datasets(package_path)
+        assert isinstance(df, pd.DataFrame), '%s is not a DataFrame' % package_path
+        datasets[package_path] = df
+
+    os.makedirs(root_dir, exist_ok=True)
+    store = DatasetStore(root_dir)
+    version = store.materialize(
+        datasets, format=format, arrow_datasets=arrow_datasets, selections=get_dataset_selections()
+    )
+    print('Materialized %d datasets to %s' % (len(datasets), os.path.join(root_dir, version)))
+
+
+def print_manifest(root_dir):
+    store = DatasetStore(root_dir)
+    if store.manifest is None:
+        print('No datasets materialized in %s' % root_dir)
+        return
+    print('Version %s' % store.version)
+    for package_path, info in sorted(store.manifest['datasets'].items()):
+        print('  %-70s %-8s %8d rows' % (package_path, info.get('format', 'parquet'), info['rows']))
+
+
+if __name__ == '__main__':
+    from common import settings
+
+    parser = argparse.ArgumentParser(description='Manage the local dataset store')
+    parser.add_argument('command', choices=['materialize', 'show'])
+    parser.add_argument('--dir', default=settings.DATASET_STORE_DIR, help='dataset store directory')
+    parser.add_argument('--format', choices=FORMATS, default='parquet', help='file format of the datasets')
+    parser.add_argument(
+        '--arrow', action='append', metavar='DATASET',
+        help='store DATASET as a memory-mappable Arrow IPC file (can be given multiple times)'
+    )
+    args = parser.parse_args()
+
+    if args.command == 'materialize':
+        materialize(args.dir, format=args.format, arrow_datasets=args.arrow)
+    else:
+        print_manifest(args.dir)
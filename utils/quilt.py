@@ -7,6 +7,8 @@ from quilt.tools import store
 from quilt.tools.command import _materialize
 from quilt.imports import _from_core_node
 
+from utils.data import select_dataset_rows, get_read_columns
+
 logger = logging.getLogger(__name__)
 
 quilt_lock = threading.Lock()
@@ -37,7 +39,13 @@ def _load_from_quilt(package_path):
     return node
 
 
-def load_datasets(packages, include_units=False):
+def load_datasets(packages, include_units=False, columns=None, filters=None):
+    """Load datasets from quilt packages
+
+    `columns` and `filters` ((column, op, value) tuples) are pushed down
+    to the parquet reader, so that only the needed columns are read and
+    row groups that cannot match the filters are skipped.
+    """
     if not isinstance(packages, (list, tuple)):
         packages = [packages]
 
@@ -55,7 +63,9 @@ def load_datasets(packages, include_units=False):
 
         if isinstance(df, str):
             pf = fastparquet.ParquetFile(df)
-            df = pf.to_pandas()
+            df = pf.to_pandas(columns=get_read_columns(columns, filters), filters=filters or [])
+
+        df = select_dataset_rows(df, columns, filters)
 
         datasets.append(df)
 
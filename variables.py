@@ -1,3 +1,9 @@
+import contextvars
+import copy
+import hashlib
+import json
+from contextlib import contextmanager
+
 import flask
 from flask import session
 
@@ -86,6 +92,108 @@ VARIABLE_DEFAULTS = {
 }
 
 
+def _copy_value(val):
+    if isinstance(val, (dict, list)):
+        return copy.deepcopy(val)
+    return val
+
+
+def _hash_values(values):
+    return hashlib.md5(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+
+class Scenario:
+    """Immutable set of variable values: the defaults overlaid with customized values
+
+    Mutable values are copied in and out, so neither the callers nor the
+    session can change a scenario after it has been created.
+    """
+
+    def __init__(self, values=None):
+        self._values = {key: _copy_value(val) for key, val in VARIABLE_DEFAULTS.items()}
+        for var_name, val in (values or {}).items():
+            assert var_name in VARIABLE_DEFAULTS
+            self._values[var_name] = _copy_value(val)
+        self.customized = {key: val for key, val in self._values.items() if val != VARIABLE_DEFAULTS[key]}
+        self.hash = _hash_values(self._values)
+        self._subset_hashes = {}
+
+    def get(self, var_name):
+        return _copy_value(self._values[var_name])
+
+    def subset_hash(self, var_names):
+        """Hash of the values of the given variables (a tuple of names)"""
+        h = self._subset_hashes.get(var_names)
+        if h is None:
+            h = _hash_values({x: self._values[x] for x in var_names})
+            self._subset_hashes[var_names] = h
+        return h
+
+    def replace(self, **values):
+        return Scenario(dict(self.customized, **values))
+
+    def __eq__(self, other):
+        return isinstance(other, Scenario) and self.hash == other.hash
+
+    def __hash__(self):
+        return hash(self.hash)
+
+
+_default_scenario = None
+_scenario_override = contextvars.ContextVar('scenario_override', default=None)
+
+
+def get_default_scenario():
+    global _default_scenario
+
+    if _default_scenario is None:
+        _default_scenario = Scenario()
+    return _default_scenario
+
+
+def get_scenario():
+    """The scenario of the current context, built at most once per request"""
+    scenario = _scenario_override.get()
+    if scenario is not None:
+        return scenario
+
+    if not flask.has_request_context():
+        return get_default_scenario()
+
+    scenario = getattr(flask.g, '_scenario', None)
+    if scenario is None:
+        values = {key: val for key, val in session.items() if key in VARIABLE_DEFAULTS}
+        scenario = Scenario(values) if values else get_default_scenario()
+        flask.g._scenario = scenario
+    return scenario
+
+
+@contextmanager
+def use_scenario(scenario):
+    """Use the given scenario instead of the one of the request within the block"""
+    token = _scenario_override.set(scenario)
+    try:
+        yield
+    finally:
+        _scenario_override.reset(token)
+
+
+@contextmanager
+def override_variables(**values):
+    """Use the given values instead of the session or default ones within the block"""
+    for var_name, value in values.items():
+        assert var_name in VARIABLE_DEFAULTS
+        assert isinstance(value, type(VARIABLE_DEFAULTS[var_name]))
+
+    with use_scenario(get_scenario().replace(**values)):
+        yield
+
+
+def _invalidate_request_scenario():
+    if flask.has_request_context():
+        flask.g.pop('_scenario', None)
+
+
 def set_variable(var_name, value):
     assert var_name in VARIABLE_DEFAULTS
     assert isinstance(value, type(VARIABLE_DEFAULTS[var_name]))
@@ -93,16 +201,22 @@ def set_variable(var_name, value):
     if value != VARIABLE_DEFAULTS[var_name]:
         assert flask.has_request_context()
 
+    if not flask.has_request_context():
+        return
+
+    _invalidate_request_scenario()
     if value == VARIABLE_DEFAULTS[var_name]:
         if var_name in session:
             del session[var_name]
         return
 
-    session[var_name] = value
+    session[var_name] = _copy_value(value)
+
+
+def reset_variables():
+    session.clear()
+    _invalidate_request_scenario()
 
 
 def get_variable(var_name):
-    if flask.has_request_context():
-        if var_name in session:
-            return session[var_name]
-    return VARIABLE_DEFAULTS[var_name]
+    return get_scenario().get(var_name)